@@ -0,0 +1,158 @@
+"""
+Бенчмарк слоя данных: обновлений в секунду при конкурентной нагрузке.
+
+Сравнивает прежнюю схему (sqlite3.connect + COMMIT на каждый вызов прямо в event loop)
+с асинхронным пулом из database.py. Каждое «обновление» повторяет горячий путь
+handle_user_message: проверка бана, анти-спам и имитация ответа Bot API. В новой
+схеме анти-спам — лимитер в памяти, а время сообщений пачкой уходит в БД через touch_users.
+
+Запуск: python benchmarks/db_throughput.py [--updates 5000] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+from ratelimit import create_limiter  # noqa: E402
+
+ACTIVITY_FLUSH_SECONDS = 0.5  # в боте — main.ACTIVITY_FLUSH_SECONDS, здесь чаще, чтобы запись попала в замер
+
+
+# === ПРЕЖНЯЯ РЕАЛИЗАЦИЯ (для сравнения) ===
+
+def legacy_init(path: str, users: int):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            is_banned INTEGER DEFAULT 0,
+            last_message_time TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+        ((i, f'user{i}', 'Bench') for i in range(1, users + 1))
+    )
+    conn.commit()
+    conn.close()
+
+def legacy_is_user_banned(path: str, user_id: int) -> bool:
+    conn = sqlite3.connect(path)
+    result = conn.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return bool(result and result[0] == 1)
+
+def legacy_check_spam(path: str, user_id: int, delay_seconds: int = 0) -> bool:
+    conn = sqlite3.connect(path)
+    result = conn.execute('SELECT last_message_time FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    now = datetime.now()
+    if result and result[0]:
+        if (now - datetime.fromisoformat(result[0])).total_seconds() < delay_seconds:
+            conn.close()
+            return True
+    conn.execute('UPDATE users SET last_message_time = ? WHERE user_id = ?', (now.isoformat(), user_id))
+    conn.commit()
+    conn.close()
+    return False
+
+
+# === НАГРУЗКА ===
+
+async def measure_lag(stop: asyncio.Event, samples: list):
+    """Фиксирует задержки event loop: насколько позже запланированного просыпается таймер"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        samples.append(loop.time() - start - 0.001)
+
+async def run_load(handle, updates: int, concurrency: int, users: int, api_latency: float) -> dict:
+    queue = asyncio.Queue()
+    for _ in range(updates):
+        queue.put_nowait(random.randint(1, users))
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            await handle(user_id)
+            await asyncio.sleep(api_latency)  # ответ пользователю через Bot API
+
+    stop = asyncio.Event()
+    lag = []
+    lag_task = asyncio.create_task(measure_lag(stop, lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    lag.sort()
+    return {
+        'updates_per_sec': updates / elapsed,
+        'elapsed': elapsed,
+        'lag_p99_ms': lag[int(len(lag) * 0.99)] * 1000 if lag else 0.0,
+        'lag_max_ms': lag[-1] * 1000 if lag else 0.0,
+    }
+
+async def bench(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        legacy_init(legacy_path, args.users)
+
+        async def legacy_handle(user_id: int):
+            if legacy_is_user_banned(legacy_path, user_id):
+                return
+            legacy_check_spam(legacy_path, user_id)
+
+        before = await run_load(legacy_handle, args.updates, args.concurrency, args.users, args.api_latency)
+
+        db.DB_NAME = os.path.join(tmp, 'pooled.db')
+        legacy_init(db.DB_NAME, args.users)
+        await db.init_db()
+
+        limiter = create_limiter('window', window=0)
+
+        async def pooled_handle(user_id: int):
+            if db.is_user_banned(user_id):
+                return
+            limiter.hit(user_id)
+
+        async def flush_activity():
+            while True:
+                await asyncio.sleep(ACTIVITY_FLUSH_SECONDS)
+                db.touch_users(limiter.drain_last_seen())
+
+        flusher = asyncio.create_task(flush_activity())
+        try:
+            after = await run_load(pooled_handle, args.updates, args.concurrency, args.users, args.api_latency)
+        finally:
+            flusher.cancel()
+            db.touch_users(limiter.drain_last_seen())
+            await db.close_db()
+
+    print(f"{'':<22}{'updates/s':>12}{'время, с':>12}{'lag p99, мс':>14}{'lag max, мс':>14}")
+    for name, result in (('до (connect на вызов)', before), ('после (пул + WAL)', after)):
+        print(f"{name:<22}{result['updates_per_sec']:>12.0f}{result['elapsed']:>12.2f}"
+              f"{result['lag_p99_ms']:>14.2f}{result['lag_max_ms']:>14.2f}")
+    print(f"Ускорение: x{after['updates_per_sec'] / before['updates_per_sec']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='имитация задержки Bot API, с')
+    asyncio.run(bench(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Локальная заглушка Telegram Bot API для бенчмарков и нагрузочных тестов.
+
+Отвечает на методы, которые использует бот, отдаёт синтетические апдейты через
+getUpdates (polling) или сама отправляет их POST-запросом на зарегистрированный
+webhook, и засекает, когда бот ответил в нужный чат.
+
+Боту достаточно передать BOT_API_URL=<адрес заглушки>.
+"""
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Mary', 'username': 'mary_bot'}
+
+# Методы, которые возвращают объект Message
+MESSAGE_METHODS = {
+    'sendMessage', 'copyMessage', 'editMessageText', 'editMessageReplyMarkup',
+    'sendDocument', 'sendPhoto', 'forwardMessage',
+}
+
+
+def make_user(user_id: int, username: Optional[str] = None) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    if username:
+        user['username'] = username
+    return user
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, forbidden_ids=()):
+        """
+        latency — искусственная задержка каждого ответа, сек;
+        retry_after_every — каждый N-й copyMessage отвечает 429 (0 — никогда);
+        forbidden_ids — чаты, которые «заблокировали бота» (403).
+        """
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.forbidden_ids = set(forbidden_ids)
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.sent_to: Counter = Counter()
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.webhook_set = asyncio.Event()
+        self.polling_started = asyncio.Event()
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._reply_waiters: Dict[int, List[asyncio.Future]] = defaultdict(list)
+        self._runner: Optional[web.AppRunner] = None
+        self._client: Optional[ClientSession] = None
+        self.base_url = ''
+
+    # === СЕРВЕР ===
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(client_max_size=50 * 1024 * 1024)  # как лимит Bot API на документы
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        self._client = ClientSession()
+        return self.base_url
+
+    async def stop(self):
+        if self._client:
+            await self._client.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        self.calls[method] += 1
+        if self.latency and method != 'getUpdates':
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get('chat_id')
+        if method == 'copyMessage' and self.retry_after_every and self.calls[method] % self.retry_after_every == 0:
+            self.errors['retry_after'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }, status=429)
+        if chat_id in self.forbidden_ids and method in MESSAGE_METHODS:
+            self.errors['forbidden'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+            }, status=403)
+
+        result = await self._result(method, params)
+        if method in MESSAGE_METHODS and isinstance(chat_id, int):
+            self.sent_to[chat_id] += 1
+            self._resolve_reply(chat_id)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _result(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_secret = params.get('secret_token')
+            self.webhook_set.set()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'copyMessage':
+            self._message_id += 1
+            return {'message_id': self._message_id}
+        if method in MESSAGE_METHODS:
+            self._message_id += 1
+            chat_id = params.get('chat_id', 0)
+            return {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        self.polling_started.set()
+        offset = params.get('offset') or 0
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), params.get('timeout') or 0)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:params.get('limit') or 100]
+
+    # === СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ===
+
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def message_update(self, user_id: int, text: str, username: Optional[str] = None, **extra) -> dict:
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id, username),
+            'text': text,
+            **extra,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': self._next_update_id(), 'message': message}
+
+    def callback_update(self, user_id: int, data: str) -> dict:
+        return {
+            'update_id': self._next_update_id(),
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': make_user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '...',
+                },
+            },
+        }
+
+    async def deliver(self, update: dict):
+        """Передаёт апдейт боту: через webhook, если он зарегистрирован, иначе в очередь getUpdates"""
+        if self.webhook_url:
+            headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+            async with self._client.post(self.webhook_url, json=update, headers=headers) as response:
+                response.raise_for_status()
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+
+    # === ОЖИДАНИЕ ОТВЕТОВ ===
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """Future, который завершится при следующем сообщении бота в chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        self._reply_waiters[chat_id].append(future)
+        return future
+
+    def _resolve_reply(self, chat_id: int):
+        waiters = self._reply_waiters.pop(chat_id, [])
+        now = time.perf_counter()
+        for future in waiters:
+            if not future.done():
+                future.set_result(now)
@@ -0,0 +1,227 @@
+"""
+Нагрузочный тест бота целиком на локальной заглушке Bot API.
+
+Бот запускается в этом же процессе против benchmarks/fake_bot_api.py и получает
+синтетические апдейты с заданным темпом по сценариям:
+
+    start      — поток /start от новых пользователей
+    questions  — вопросы пользователей админу
+    spam       — несколько пользователей шлют сообщения подряд (срабатывает анти-спам)
+    banned     — сообщения от забаненных
+    broadcast  — админ запускает рассылку по всей базе
+    mixed      — поток /start во время идущей рассылки (ответы обгоняют её в outbound)
+
+Для каждого сценария печатаются updates/s, p50/p99 задержки «апдейт → ответ» и
+число обращений к БД на апдейт, для рассылки — скорость в сообщениях в секунду.
+Общий темп отправки бота задаёт --send-rate (в проде — outbound.GLOBAL_RATE).
+Внешняя сеть и CI не нужны: всё работает на 127.0.0.1.
+
+Запуск: python benchmarks/load_test.py [--transport feed|polling|webhook] [--updates 1000] [--rate 0]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from update_latency import ADMIN_ID, percentile, start_bot, stop_bot  # noqa: E402
+
+SCENARIOS = ['start', 'questions', 'spam', 'banned', 'broadcast', 'mixed']
+SPAMMERS = 10  # пользователей в сценарии spam, каждый шлёт updates / SPAMMERS сообщений подряд
+
+_user_ids = itertools.count(100_000)
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, args):
+        self.api = api
+        self.args = args
+
+    async def send(self, update: dict):
+        """Передаёт апдейт боту выбранным транспортом"""
+        if self.args.transport == 'feed':
+            import main
+            from aiogram.types import Update
+            await main.dp.feed_update(main.bot, Update.model_validate(update, context={'bot': main.bot}))
+        else:
+            await self.api.deliver(update)
+
+    async def request(self, chat_id: int, update: dict) -> float:
+        """Отправляет апдейт и ждёт ответа бота в chat_id, возвращает задержку"""
+        reply = self.api.expect_reply(chat_id)
+        started = time.perf_counter()
+        await self.send(update)
+        return await asyncio.wait_for(reply, 30) - started
+
+    async def wait_sent(self, chat_id: int, count: int):
+        """Ждёт, пока число сообщений бота в chat_id дойдёт до count"""
+        while self.api.sent_to[chat_id] < count:
+            await asyncio.sleep(0.01)
+
+    async def load(self, name: str, conversations: list) -> dict:
+        """
+        conversations — список (chat_id, [апдейты]); апдейты одного чата идут
+        последовательно, разные чаты — параллельно с темпом --rate апдейтов в секунду.
+        """
+        import database as db
+        import metrics
+        latencies = []
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        interval = 1 / self.args.rate if self.args.rate else 0
+        updates = sum(len(chat_updates) for _, chat_updates in conversations)
+
+        async def conversation(chat_id: int, chat_updates: list, delay: float):
+            await asyncio.sleep(delay)
+            async with semaphore:
+                for update in chat_updates:
+                    latencies.append(await self.request(chat_id, update))
+
+        queries_before = metrics.DB_QUERIES.total()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            conversation(chat_id, chat_updates, i * interval)
+            for i, (chat_id, chat_updates) in enumerate(conversations)
+        ))
+        elapsed = time.perf_counter() - started
+        # Отложенная запись тоже вызвана этими апдейтами — учитываем её
+        await db.flush_writes()
+        return {
+            'name': name,
+            'updates': updates,
+            'updates_per_sec': updates / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'db_ops': (metrics.DB_QUERIES.total() - queries_before) / updates,
+        }
+
+    # === СЦЕНАРИИ ===
+
+    async def start(self) -> dict:
+        ids = [next(_user_ids) for _ in range(self.args.updates)]
+        return await self.load('start', [(i, [self.api.message_update(i, '/start')]) for i in ids])
+
+    async def questions(self) -> dict:
+        ids = [next(_user_ids) for _ in range(self.args.updates)]
+        return await self.load('questions', [
+            (i, [self.api.message_update(i, f'Вопрос от {i}: когда обновление?')]) for i in ids
+        ])
+
+    async def spam(self) -> dict:
+        per_user = max(1, self.args.updates // SPAMMERS)
+        ids = [next(_user_ids) for _ in range(SPAMMERS)]
+        return await self.load('spam', [
+            (i, [self.api.message_update(i, f'спам {n}') for n in range(per_user)]) for i in ids
+        ])
+
+    async def banned(self) -> dict:
+        import database as db
+        ids = [next(_user_ids) for _ in range(self.args.updates)]
+        for user_id in ids:
+            db.add_user(user_id, None, f'User{user_id}')
+        await db.flush_writes()
+        for user_id in ids:
+            await db.ban_user(user_id)
+        return await self.load('banned', [(i, [self.api.message_update(i, 'меня забанили?')]) for i in ids])
+
+    async def start_broadcast(self) -> int:
+        """Добавляет получателей и запускает рассылку от админа, возвращает число получателей"""
+        import broadcast
+        import database as db
+        for _ in range(self.args.broadcast_users):
+            user_id = next(_user_ids)
+            db.add_user(user_id, None, f'User{user_id}')
+        await db.flush_writes()
+        recipients = await db.count_users(exclude_ids={ADMIN_ID}, **broadcast.RECIPIENT_FILTERS)
+        # Кнопка отвечает двумя сообщениями: приглашением ввести текст и выбором аудитории.
+        # Текст рассылки отправляется после обоих, иначе он обгонит смену состояния FSM
+        sent = self.api.sent_to[ADMIN_ID]
+        await self.send(self.api.message_update(ADMIN_ID, '📢 Рассылка новостей'))
+        await asyncio.wait_for(self.wait_sent(ADMIN_ID, sent + 2), 30)
+        # Ответ «рассылка запущена» приходит сразу, само задание идёт в фоне
+        await self.request(ADMIN_ID, self.api.message_update(ADMIN_ID, 'Новости недели'))
+        return recipients
+
+    async def broadcast(self) -> dict:
+        import main
+        sent_before = self.api.calls['copyMessage']
+        started = time.perf_counter()
+        recipients = await self.start_broadcast()
+        while main.active_broadcasts:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        sent = self.api.calls['copyMessage'] - sent_before
+        return {'name': 'broadcast', 'recipients': recipients, 'sent': sent, 'msgs_per_sec': sent / elapsed}
+
+    async def mixed(self) -> dict:
+        import main
+        await self.start_broadcast()
+        ids = [next(_user_ids) for _ in range(self.args.updates)]
+        result = await self.load('mixed', [(i, [self.api.message_update(i, '/start')]) for i in ids])
+        result['during_broadcast'] = bool(main.active_broadcasts)
+        for control in list(main.active_broadcasts.values()):
+            control.cancel()
+        while main.active_broadcasts:
+            await asyncio.sleep(0.05)
+        return result
+
+
+async def bench(args):
+    api = FakeBotAPI(latency=args.api_latency)
+    base_url = await api.start()
+    os.environ.update(
+        BOT_TOKEN='42:bench', ADMIN_ID=str(ADMIN_ID), BOT_API_URL=base_url, BACKUP_INTERVAL='0',
+        # Лимиты Telegram задаются аргументами: общий --send-rate, на чат — без ограничения
+        OUTBOUND_RATE=str(args.send_rate), OUTBOUND_CHAT_RATE='100000',
+    )
+    import database as db
+    import main  # noqa: F401 — конфигурация читается из окружения при импорте
+    logging.getLogger().setLevel(logging.WARNING)
+
+    test = LoadTest(api, args)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'users.db')
+        task = await start_bot('webhook' if args.transport == 'webhook' else 'polling', api)
+        try:
+            for name in args.scenarios:
+                results.append(await getattr(test, name)())
+        finally:
+            await stop_bot(task)
+            await api.stop()
+
+    print(f"транспорт: {args.transport}, задержка API: {args.api_latency * 1000:.0f} мс")
+    print(f"{'сценарий':<12}{'апдейтов':>10}{'updates/s':>12}{'p50, мс':>10}{'p99, мс':>10}{'БД/апдейт':>11}")
+    for r in results:
+        if r['name'] == 'broadcast':
+            print(f"{'broadcast':<12}{r['sent']:>10}{r['msgs_per_sec']:>12.0f} сообщ./с (получателей: {r['recipients']})")
+        else:
+            print(
+                f"{r['name']:<12}{r['updates']:>10}{r['updates_per_sec']:>12.0f}"
+                f"{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['db_ops']:>11.2f}"
+                + ("" if r.get('during_broadcast', True) else "  (рассылка закончилась раньше)")
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', default='feed', choices=['feed', 'polling', 'webhook'],
+                        help='feed — прямо в dp.feed_update, без сетевого приёма апдейтов')
+    parser.add_argument('--updates', type=int, default=1000, help='апдейтов на сценарий')
+    parser.add_argument('--rate', type=float, default=0, help='темп подачи апдейтов в секунду, 0 — без ограничения')
+    parser.add_argument('--concurrency', type=int, default=100, help='одновременных диалогов')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки, с')
+    parser.add_argument('--broadcast-users', type=int, default=2000, help='дополнительных получателей рассылки')
+    parser.add_argument('--send-rate', type=float, default=1000,
+                        help='общий темп отправки бота, сообщ./с (в проде — outbound.GLOBAL_RATE)')
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Задержка «апдейт → ответ» в режимах polling и webhook на локальной заглушке Bot API.
+
+Бот запускается в этом же процессе против benchmarks/fake_bot_api.py, получает
+/start от разных пользователей и отвечает приветствием; засекается время от
+выдачи апдейта до сообщения бота в чат пользователя.
+
+Запуск: python benchmarks/update_latency.py [--updates 500] [--concurrency 50] [--modes polling webhook]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+ADMIN_ID = 1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def start_bot(mode: str, api: FakeBotAPI):
+    import main
+    main.BOT_MODE = mode
+    main.WEBHOOK_PORT = free_port()
+    main.WEBHOOK_HOST = '127.0.0.1'
+    main.WEBHOOK_URL = f'http://127.0.0.1:{main.WEBHOOK_PORT}' if mode == 'webhook' else None
+    main.WEBHOOK_SECRET = 'bench-secret'
+    main.METRICS_PORT = 0
+    task = asyncio.create_task(main.main())
+    ready = api.webhook_set if mode == 'webhook' else api.polling_started
+    await asyncio.wait_for(ready.wait(), 10)
+    return task
+
+
+async def stop_bot(task: asyncio.Task):
+    """Штатная остановка, как по SIGTERM"""
+    import main
+    main.stop_event.set()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
+async def measure(mode: str, api: FakeBotAPI, updates: int, concurrency: int) -> dict:
+    api.webhook_set.clear()
+    api.polling_started.clear()
+    task = await start_bot(mode, api)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    base_user = 10_000 * (1 + len(api.sent_to))
+
+    async def one(user_id: int):
+        async with semaphore:
+            reply = api.expect_reply(user_id)
+            started = time.perf_counter()
+            await api.deliver(api.message_update(user_id, '/start'))
+            latencies.append(await asyncio.wait_for(reply, 30) - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(base_user + i) for i in range(updates)))
+    finally:
+        elapsed = time.perf_counter() - started
+        await stop_bot(task)
+    return {
+        'updates_per_sec': updates / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def bench(args):
+    api = FakeBotAPI(latency=args.api_latency)
+    base_url = await api.start()
+    os.environ.update(
+        BOT_TOKEN='42:bench', ADMIN_ID=str(ADMIN_ID), BOT_API_URL=base_url, BACKUP_INTERVAL='0',
+        # Меряется обработка апдейтов ботом, а не лимиты Telegram
+        OUTBOUND_RATE='100000', OUTBOUND_CHAT_RATE='100000',
+    )
+    import database as db
+    import main  # noqa: F401 — конфигурация читается из окружения при импорте
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, 'users.db')
+        try:
+            for mode in args.modes:
+                results[mode] = await measure(mode, api, args.updates, args.concurrency)
+        finally:
+            await api.stop()
+
+    print(f"{'режим':<10}{'updates/s':>12}{'p50, мс':>10}{'p99, мс':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<10}{r['updates_per_sec']:>12.0f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки, с')
+    parser.add_argument('--modes', nargs='+', default=['polling', 'webhook'], choices=['polling', 'webhook'])
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
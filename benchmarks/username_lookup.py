@@ -0,0 +1,105 @@
+"""
+Бенчмарк поиска по username и выборки забаненных на больших таблицах.
+
+Для каждого размера таблицы строит БД в старой схеме (без индексов), замеряет
+get_user_by_username и get_banned_users, затем применяет миграции через
+init_db и замеряет снова. После миграций время не должно расти с размером таблицы.
+
+Запуск: python benchmarks/username_lookup.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+BANNED_EVERY = 5000  # каждый N-й пользователь забанен
+
+
+def build_legacy_db(path: str, users: int):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            is_banned INTEGER DEFAULT 0,
+            last_message_time TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO users (user_id, username, first_name, is_banned) VALUES (?, ?, ?, ?)',
+        ((i, f'User_{i}', 'Bench', int(i % BANNED_EVERY == 0)) for i in range(1, users + 1))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def time_calls(func, calls: list) -> float:
+    """Среднее время одного вызова func(*args) для каждого args из calls, мкс"""
+    started = time.perf_counter()
+    for args in calls:
+        await func(*args)
+    return (time.perf_counter() - started) / len(calls) * 1e6
+
+
+async def legacy_get_user_by_username(username: str):
+    """Запрос до миграций: точное совпадение, полный просмотр таблицы"""
+    return await db._fetchone('SELECT user_id, username, first_name FROM users WHERE username = ?', (username,))
+
+
+async def measure(users: int, lookups: int) -> dict:
+    # Ищем в другом регистре: после миграции такие запросы тоже находят пользователя
+    names = [(f'user_{random.randint(1, users)}',) for _ in range(lookups)]
+    result = {
+        'before_username_us': await time_calls(legacy_get_user_by_username, names),
+        'before_banned_us': await time_calls(db.get_banned_users, [()] * 5),
+    }
+    await db.close_db()
+    await db.init_db()  # применяет миграции
+    result['after_username_us'] = await time_calls(db.get_user_by_username, names)
+    result['after_banned_us'] = await time_calls(db.get_banned_users, [()] * 5)
+    result['found'] = await db.get_user_by_username(names[0][0]) is not None
+    return result
+
+
+async def bench(args):
+    print(f"{'пользователей':>14}{'username до, мкс':>18}{'после, мкс':>12}{'бан-лист до, мкс':>18}{'после, мкс':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            db.DB_NAME = os.path.join(tmp, f'users_{size}.db')
+            build_legacy_db(db.DB_NAME, size)
+            # init без миграций: только пул соединений над старой схемой
+            migrations, db.MIGRATIONS = db.MIGRATIONS, []
+            await db.init_db()
+            db.MIGRATIONS = migrations
+            try:
+                r = await measure(size, args.lookups)
+                plan = await db._fetchall(
+                    'EXPLAIN QUERY PLAN SELECT user_id FROM users WHERE username = ? COLLATE NOCASE', ('x',)
+                )
+            finally:
+                await db.close_db()
+            print(f"{size:>14}{r['before_username_us']:>18.1f}{r['after_username_us']:>12.1f}"
+                  f"{r['before_banned_us']:>18.1f}{r['after_banned_us']:>12.1f}")
+        print(f"План запроса по username: {plan[-1][-1]}")
+        print(f"Поиск без учёта регистра находит пользователя: {r['found']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--lookups', type=int, default=200)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Collection, Iterable, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import database as db
+import metrics
+import outbound
+
+# === ДВИЖОК РАССЫЛКИ ===
+# Отправка идёт несколькими параллельными воркерами в полосе outbound.BULK: общий
+# темп бота держит диспетчер исходящих сообщений, и ответы пользователям
+# обгоняют рассылку. TelegramRetryAfter ставит на паузу все отправки, а не
+# считается ошибкой; сетевые ошибки и 5xx повторяются с экспоненциальной задержкой.
+
+BROADCAST_CONCURRENCY = 20  # одновременных запросов к Bot API
+MAX_RETRIES = 3             # повторов при сетевых ошибках
+RETRY_BACKOFF = 1.0         # начальная задержка перед повтором, сек
+RECIPIENTS_BATCH = 500      # получателей за одно чтение из БД
+# Кому не отправлять рассылку: недоступных (заблокировали бота) пропускаем всегда
+RECIPIENT_FILTERS = {'exclude_unreachable': True}
+CLAIM_CHUNK = 50            # получателей, помечаемых pending за раз
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    unreachable: int = 0  # из failed: заблокировали бота или удалили аккаунт
+    retried: int = 0
+    resumed_from: int = 0  # получателей, обработанных до перезапуска
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Обработано получателей в секунду"""
+        return (self.done - self.resumed_from) / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени, сек"""
+        if not self.rate or self.total < self.done:
+            return None
+        return (self.total - self.done) / self.rate
+
+    def format(self) -> str:
+        eta = f"{self.eta:.0f} с" if self.eta is not None else "—"
+        return (
+            f"Отправлено: {self.sent}\n"
+            f"Ошибок: {self.failed} (заблокировали бота: {self.unreachable})\n"
+            f"Скорость: {self.rate:.1f} сообщ./с\n"
+            f"Осталось: {eta}"
+        )
+
+class JobControl:
+    """Пауза, отмена и остановка (до перезапуска бота) выполняющейся рассылки"""
+
+    def __init__(self, paused: bool = False):
+        self._running = asyncio.Event()
+        if not paused:
+            self._running.set()
+        self.cancelled = False
+        self.stopped = False
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._running.set()
+
+    def stop(self):
+        """Досылает уже начатые отправки и завершает рассылку, не отменяя задание"""
+        self.stopped = True
+        self._running.set()
+
+    @property
+    def halted(self) -> bool:
+        return self.cancelled or self.stopped
+
+    async def wait(self):
+        """Блокирует отправку, пока рассылка на паузе"""
+        await self._running.wait()
+
+ProgressCallback = Callable[[BroadcastStats], Awaitable[None]]
+ResultCallback = Callable[[int, bool], None]
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: Bot,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF,
+    ):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    async def send(self, chat_id: int, from_chat_id: int, message_id: int, stats: BroadcastStats) -> bool:
+        """Копирует сообщение одному получателю, возвращает True при успехе"""
+        attempt = 0
+        while True:
+            try:
+                await self.bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                return True
+            except TelegramRetryAfter as e:
+                # Паузу для всех отправок ставит OutboundMiddleware, здесь только повтор
+                logging.warning(f"Рассылка: flood control, пауза {e.retry_after} с")
+            except TelegramForbiddenError:
+                # Пользователь помечается недоступным в ReachabilityMiddleware сессии бота
+                stats.unreachable += 1
+                return False
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logging.warning(f"Не удалось отправить пользователю {chat_id}: {e}")
+                    return False
+                stats.retried += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            except Exception as e:
+                logging.warning(f"Не удалось отправить пользователю {chat_id}: {e}")
+                return False
+
+    async def run(
+        self,
+        from_chat_id: int,
+        message_id: int,
+        user_ids: Union[Iterable[int], AsyncIterable[int]],
+        total: int = 0,
+        on_progress: Optional[ProgressCallback] = None,
+        progress_interval: float = 5.0,
+        on_result: Optional[ResultCallback] = None,
+        stats: Optional[BroadcastStats] = None,
+        control: Optional[JobControl] = None,
+    ) -> BroadcastStats:
+        if stats is None:
+            stats = BroadcastStats(total=total)
+        if control is None:
+            control = JobControl()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def produce():
+            if hasattr(user_ids, '__aiter__'):
+                async for user_id in user_ids:
+                    await control.wait()
+                    if control.halted:
+                        break
+                    await queue.put(user_id)
+            else:
+                for user_id in user_ids:
+                    await control.wait()
+                    if control.halted:
+                        break
+                    await queue.put(user_id)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                await control.wait()
+                if control.halted:
+                    continue  # дочитываем очередь до конца, не отправляя
+                ok = await self.send(user_id, from_chat_id, message_id, stats)
+                if ok:
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+                metrics.BROADCAST_MESSAGES.inc(result='sent' if ok else 'failed')
+                if on_result:
+                    on_result(user_id, ok)
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_interval)
+                try:
+                    await on_progress(stats)
+                except Exception as e:
+                    logging.warning(f"Рассылка: не удалось обновить прогресс: {e}")
+
+        reporter = asyncio.create_task(report()) if on_progress else None
+        try:
+            # Воркеры создаются внутри блока и наследуют полосу, прогресс — нет
+            with outbound.lane(outbound.BULK):
+                await asyncio.gather(produce(), *(worker() for _ in range(self.concurrency)))
+        finally:
+            stats.finished_at = time.monotonic()
+            if reporter:
+                reporter.cancel()
+        return stats
+
+
+# === СЕГМЕНТЫ АУДИТОРИИ ===
+# Сегмент задаётся строкой: all, not_banned, active:<дней>, new:<дней>,
+# joined:<ГГГГ-ММ-ДД>. Относительные даты переводятся в абсолютные при создании
+# задания, поэтому продолжение после перезапуска идёт по той же аудитории.
+
+SEGMENTS = {
+    'all': 'Все пользователи',
+    'not_banned': 'Все, кроме забаненных',
+    'active:7': 'Писали за 7 дней',
+    'active:30': 'Писали за 30 дней',
+    'new:7': 'Пришли за 7 дней',
+    'new:30': 'Пришли за 30 дней',
+}
+
+def _days_ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+def segment_filters(segment: str, recipients_only: bool = True) -> dict:
+    """
+    Фильтры db.count_users / db.iter_user_batches для сегмента; ValueError — неверный сегмент.
+    recipients_only=False — без RECIPIENT_FILTERS (например, для выгрузки).
+    """
+    kind, _, arg = segment.partition(':')
+    filters = dict(RECIPIENT_FILTERS) if recipients_only else {}
+    if kind == 'all' and not arg:
+        return filters
+    filters['exclude_banned'] = True
+    if kind == 'not_banned' and not arg:
+        pass
+    elif kind == 'active' and arg.isdigit():
+        filters['active_since'] = _days_ago(int(arg))
+    elif kind == 'new' and arg.isdigit():
+        filters['joined_after'] = _days_ago(int(arg))
+    elif kind == 'joined':
+        filters['joined_after'] = datetime.strptime(arg, '%Y-%m-%d').strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        raise ValueError(f"Неизвестный сегмент: {segment}")
+    return filters
+
+def segment_title(segment: str) -> str:
+    if segment in SEGMENTS:
+        return SEGMENTS[segment]
+    kind, _, arg = segment.partition(':')
+    titles = {'active': f"Писали за {arg} дн.", 'new': f"Пришли за {arg} дн.", 'joined': f"Пришли с {arg}"}
+    return titles.get(kind, segment)
+
+async def count_audience(segment: str, exclude_ids: Collection[int] = ()) -> int:
+    """Пробный подсчёт: сколько получателей будет у рассылки по сегменту"""
+    return await db.count_users(exclude_ids=exclude_ids, **segment_filters(segment))
+
+
+# === СОХРАНЯЕМЫЕ ЗАДАНИЯ ===
+
+async def start_job(
+    from_chat_id: int, message_id: int, exclude_ids: Collection[int] = (), segment: str = 'all'
+) -> Tuple[int, int, int, str, int, int, str]:
+    """Создаёт задание рассылки по сегменту в БД, возвращает его запись"""
+    filters = segment_filters(segment)
+    total = await db.count_users(exclude_ids=exclude_ids, **filters)
+    job_id = await db.create_broadcast(from_chat_id, message_id, total, json.dumps(filters))
+    return await db.get_broadcast(job_id)
+
+async def run_job(
+    broadcaster: Broadcaster,
+    job: Tuple[int, int, int, str, int, int, str],
+    exclude_ids: Collection[int] = (),
+    on_progress: Optional[ProgressCallback] = None,
+    control: Optional[JobControl] = None,
+) -> BroadcastStats:
+    """
+    Выполняет (или продолжает после перезапуска) задание рассылки.
+    Получатели читаются пачками от cursor, итоги сохраняются пачками.
+    """
+    job_id, from_chat_id, message_id, status, cursor, total, filters = job
+    filters = {**RECIPIENT_FILTERS, **json.loads(filters)}
+    counts = await db.get_broadcast_counts(job_id)
+    stats = BroadcastStats(
+        total=total,
+        sent=counts.get('sent', 0),
+        failed=counts.get('failed', 0),
+    )
+    stats.resumed_from = stats.done
+    results: List[Tuple[int, bool]] = []
+
+    async def flush_results():
+        batch = results[:]
+        results.clear()
+        await db.record_broadcast_results(job_id, batch)
+
+    async def recipients() -> AsyncIterator[int]:
+        batches = db.iter_user_batches(
+            after=cursor, batch_size=RECIPIENTS_BATCH, exclude_ids=exclude_ids, **filters
+        )
+        async for rows in batches:
+            # Получателей помечаем небольшими порциями прямо перед отправкой: после
+            # аварийной остановки без отправки останутся только они
+            for start in range(0, len(rows), CLAIM_CHUNK):
+                chunk = [row[0] for row in rows[start:start + CLAIM_CHUNK]]
+                await flush_results()
+                for user_id in await db.claim_recipients(job_id, chunk, chunk[-1]):
+                    yield user_id
+
+    if stats.resumed_from:
+        logging.info(f"Рассылка #{job_id}: продолжение с user_id > {cursor}, уже обработано {stats.resumed_from}")
+
+    try:
+        await broadcaster.run(
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            user_ids=recipients(),
+            on_progress=on_progress,
+            on_result=lambda user_id, ok: results.append((user_id, ok)),
+            stats=stats,
+            control=control,
+        )
+    except asyncio.CancelledError:
+        # Уже отправленное не должно уйти повторно после перезапуска
+        await flush_results()
+        raise
+    await flush_results()
+    if control and control.stopped:
+        # Задание остаётся running/paused и продолжится после перезапуска бота
+        released = await db.release_recipients(job_id, cursor)
+        logging.info(f"Рассылка #{job_id} остановлена: обработано {stats.done}, вернули в очередь {released}")
+        return stats
+    await db.finish_broadcast(job_id, 'cancelled' if control and control.cancelled else 'done')
+    return stats
@@ -1,15 +1,127 @@
+import asyncio
+import logging
 import sqlite3
-from typing import List, Tuple, Optional
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Collection, Dict, List, Set, Tuple, Optional
+
+import metrics
 
 DB_NAME = 'users.db'
+DB_READERS = 4  # Потоков-читателей (WAL позволяет читать параллельно с записью)
+USERS_BATCH = 1000  # Строк за один запрос при потоковом обходе пользователей
+STATS_TTL = 60  # Сколько секунд отдавать статистику из кэша
+WRITE_FLUSH_INTERVAL = 0.2  # Как часто сбрасывать отложенную запись, сек
+WRITE_FLUSH_ROWS = 500  # ...или раньше, если накопилось столько строк
+REPLY_CACHE_SIZE = 10_000  # Сообщений админа, для которых адресат ответа держится в памяти
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
+# Настройки соединения: WAL + synchronous=NORMAL убирают fsync на каждый COMMIT.
+# auto_vacuum действует только на новый файл (и должен идти до journal_mode):
+# существующую БД переводит лишь enable_incremental_vacuum()
+_PRAGMAS = (
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=134217728',
+    'PRAGMA foreign_keys=ON',
+)
+
+# === ПУЛ СОЕДИНЕНИЙ ===
+# Все запросы выполняются вне event loop: запись — в единственном потоке-писателе,
+# чтение — в небольшом пуле. Каждый поток держит своё долгоживущее соединение,
+# подготовленные выражения кэшируются sqlite3 (cached_statements).
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_writer: Optional[ThreadPoolExecutor] = None
+_readers: Optional[ThreadPoolExecutor] = None
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _get_conn() -> sqlite3.Connection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def _execute_sync(sql: str, params: tuple) -> int:
+    conn = _get_conn()
+    cursor = conn.execute(sql, params)
+    conn.commit()
+    return cursor.rowcount
+
+def _fetchone_sync(sql: str, params: tuple) -> Optional[Tuple]:
+    return _get_conn().execute(sql, params).fetchone()
+
+def _fetchall_sync(sql: str, params: tuple) -> List[Tuple]:
+    return _get_conn().execute(sql, params).fetchall()
+
+def _transaction_sync(func: Callable[[sqlite3.Connection], Any]) -> Any:
+    conn = _get_conn()
+    with conn:
+        return func(conn)
+
+async def _run(executor: Optional[ThreadPoolExecutor], func: Callable, *args) -> Any:
+    if executor is None:
+        raise RuntimeError("База данных не инициализирована: вызовите init_db()")
+    metrics.DB_QUERIES.inc(kind='write' if executor is _writer else 'read')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args))
+
+async def _execute(sql: str, params: tuple = ()) -> int:
+    """Запрос на запись в потоке-писателе, возвращает число затронутых строк"""
+    return await _run(_writer, _execute_sync, sql, params)
+
+async def _fetchone(sql: str, params: tuple = ()) -> Optional[Tuple]:
+    return await _run(_readers, _fetchone_sync, sql, params)
+
+async def _fetchall(sql: str, params: tuple = ()) -> List[Tuple]:
+    return await _run(_readers, _fetchall_sync, sql, params)
+
+async def _transaction(func: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Выполняет func(conn) в одной транзакции потока-писателя"""
+    return await _run(_writer, _transaction_sync, func)
+
+async def _read(func: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Выполняет несколько чтений func(conn) подряд в потоке-читателе"""
+    return await _run(_readers, _transaction_sync, func)
+
+def _timed(func):
+    """Пишет время вызова публичной функции модуля в метрики"""
+    return metrics.timed(metrics.DB_DURATION, function=func.__name__)(func)
+
+# === ИНИЦИАЛИЗАЦИЯ ===
+
+def _ensure_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Добавляет колонку в уже существующую таблицу, если её ещё нет"""
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# === МИГРАЦИИ ===
+# Версия схемы хранится в PRAGMA user_version. При старте применяются все миграции
+# новее текущей версии, каждая в своей транзакции. Новые миграции только
+# дописываются в конец MIGRATIONS, существующие не меняются.
+
+def _migration_initial(conn: sqlite3.Connection):
+    """Базовая схема: таблицы могут уже существовать в БД без версии"""
     # Таблица пользователей
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
             username TEXT,
@@ -19,102 +131,833 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    # Когда Telegram ответил, что пользователю нельзя писать (NULL — доступен)
+    _ensure_column(conn, 'users', 'unreachable_at', 'TIMESTAMP')
     
-    conn.commit()
-    conn.close()
-
-def add_user(user_id: int, username: str, first_name: str):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO users (user_id, username, first_name, is_banned, last_message_time)
-        VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP)
-    ''', (user_id, username, first_name))
-    conn.commit()
-    conn.close()
-
-def get_all_users() -> List[Tuple[int]]:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM users')
-    users = cursor.fetchall()
-    conn.close()
-    return users
-
-def get_user_by_username(username: str) -> Optional[Tuple[int, str, str]]:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, username, first_name FROM users WHERE username = ?', (username,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def get_user_by_id(user_id: int) -> Optional[Tuple]:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, username, first_name, is_banned FROM users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-# === АНТИ-СПАМ ===
-
-def check_spam(user_id: int, delay_seconds: int = 5) -> bool:
-    """
-    Проверяет, не слишком ли часто пишет пользователь.
-    Возвращает True, если спам (слишком быстро), False если всё ок.
-    """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT last_message_time FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+    # Задания рассылки: cursor — последний user_id, переданный на отправку
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
     
-    now = datetime.now()
+    # Отложенные сообщения: не больше одного сообщения каждого вида на пользователя
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            due_at REAL NOT NULL,
+            UNIQUE (user_id, kind)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_due ON scheduled_messages (due_at)')
     
-    if result and result[0]:
-        last_time = datetime.fromisoformat(result[0])
-        delta = (now - last_time).total_seconds()
-        
-        if delta < delay_seconds:
+    # Статус по каждому получателю: pending (взят в отправку) / sent / failed
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_username_index(conn: sqlite3.Connection):
+    """Поиск по username без учёта регистра, как в Telegram"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)')
+
+def _migration_banned_index(conn: sqlite3.Connection):
+    """Частичный индекс: в нём только забаненные, поэтому он крошечный"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_banned ON users (user_id) WHERE is_banned = 1')
+
+def _migration_normalize_last_message_time(conn: sqlite3.Connection):
+    """Старый check_spam писал isoformat(), приводим к формату CURRENT_TIMESTAMP для сравнений в SQL"""
+    conn.execute('''
+        UPDATE users SET last_message_time = replace(substr(last_message_time, 1, 19), 'T', ' ')
+        WHERE last_message_time LIKE '%T%'
+    ''')
+
+def _migration_fsm_states(conn: sqlite3.Connection):
+    """Состояния FSM в БД: общие для всех процессов бота и переживают перезапуск"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+def _migration_admin_messages(conn: sqlite3.Connection):
+    """Какие пользователи стоят за сообщением в чате админа: на него можно ответить реплаем"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_messages (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (message_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_admin_messages_created ON admin_messages (created_at)')
+
+def _migration_audience_segments(conn: sqlite3.Connection):
+    """Сегменты рассылок: фильтры аудитории в задании и индексы по датам"""
+    _ensure_column(conn, 'broadcasts', 'filters', "TEXT NOT NULL DEFAULT '{}'")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_message ON users (last_message_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)')
+
+MIGRATIONS = [
+    _migration_initial,
+    _migration_username_index,
+    _migration_banned_index,
+    _migration_normalize_last_message_time,
+    _migration_fsm_states,
+    _migration_admin_messages,
+    _migration_audience_segments,
+]
+
+def _migrate() -> Tuple[int, int]:
+    """Применяет недостающие миграции, возвращает (версия до, версия после)"""
+    conn = _get_conn()
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logging.info(f"Схема БД обновлена до версии {version}: {migration.__doc__}")
+    return current, max(current, len(MIGRATIONS))
+
+@_timed
+async def init_db():
+    global _writer, _readers
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix='db-reader')
+    await _run(_writer, _migrate)
+    await reload_banned()
+    _start_write_behind()
+
+@_timed
+async def ping():
+    """Проверка для /readyz: пул читателей отвечает"""
+    await _fetchone('SELECT 1')
+
+async def close_db(timeout: Optional[float] = None):
+    """
+    Сбрасывает отложенную запись, дожидается запросов и закрывает все соединения.
+    timeout ограничивает ожидание: если долгий запрос (например, резервная копия)
+    не закончился, соединения остаются открытыми, а поток доделывает его сам.
+    """
+    global _writer, _readers
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    executors = [executor for executor in (_writer, _readers) if executor is not None]
+    try:
+        # shield: по таймауту отложенная запись не прерывается на середине транзакции
+        await asyncio.wait_for(asyncio.shield(_stop_write_behind()), remaining())
+        # Потоки пула ждём вне event loop, чтобы он продолжал отвечать (/healthz)
+        await asyncio.wait_for(asyncio.shield(loop.run_in_executor(
+            None, lambda: [executor.shutdown(wait=True) for executor in executors]
+        )), remaining())
+    except asyncio.TimeoutError:
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        _writer = _readers = None
+        logging.warning("БД: не дождались завершения запросов, соединения не закрыты")
+        return
+    _writer = _readers = None
+    with _connections_lock:
+        for conn in _connections:
             conn.close()
-            return True  # Спам!
-    
-    # Обновляем время последнего сообщения
-    cursor.execute('UPDATE users SET last_message_time = ? WHERE user_id = ?', (now.isoformat(), user_id))
-    conn.commit()
-    conn.close()
-    
-    return False  # Всё ок
+        _connections.clear()
+    # Потоки пула пересоздаются при следующем init_db, старые thread-local не нужны
+    _local.__dict__.clear()
+
+# === ПОЛЬЗОВАТЕЛИ ===
+
+def add_user(user_id: int, username: str, first_name: str):
+    """Ставит пользователя в очередь записи; бан и created_at существующей строки сохраняются"""
+    _pending_users[user_id] = (username, first_name, _utcnow())
+    _pending_activity.pop(user_id, None)  # время уже есть в upsert
+    _pending_unreachable.pop(user_id, None)  # раз пишет — снова доступен
+    _notify_writer()
+
+def _user_filters(
+    exclude_ids: Collection[int] = (),
+    exclude_banned: bool = False,
+    exclude_unreachable: bool = False,
+    active_since: Optional[str] = None,
+    joined_after: Optional[str] = None,
+) -> Tuple[str, tuple]:
+    """
+    Собирает условия WHERE для выборок по пользователям.
+    active_since и joined_after — время в формате CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS').
+    """
+    conditions, params = [], []
+    if exclude_ids:
+        conditions.append(f"user_id NOT IN ({', '.join('?' * len(exclude_ids))})")
+        params.extend(exclude_ids)
+    if exclude_banned:
+        conditions.append('is_banned = 0')
+    if exclude_unreachable:
+        conditions.append('unreachable_at IS NULL')
+    if active_since:
+        conditions.append('last_message_time >= ?')
+        params.append(active_since)
+    if joined_after:
+        conditions.append('created_at >= ?')
+        params.append(joined_after)
+    return ' AND '.join(conditions) or '1', tuple(params)
+
+async def iter_user_batches(
+    after: int = 0,
+    batch_size: int = USERS_BATCH,
+    columns: str = 'user_id',
+    **filters,
+) -> AsyncIterator[List[Tuple]]:
+    """
+    Потоково обходит пользователей по возрастанию user_id (keyset-пагинация:
+    user_id > последний прочитанный), отдавая пачки не больше batch_size строк.
+    Первая колонка в columns должна быть user_id.
+    """
+    where, params = _user_filters(**filters)
+    while True:
+        rows = await _fetchall(
+            f'SELECT {columns} FROM users WHERE user_id > ? AND {where} ORDER BY user_id LIMIT ?',
+            (after, *params, batch_size)
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+async def iter_users(after: int = 0, batch_size: int = USERS_BATCH, **filters) -> AsyncIterator[int]:
+    """Потоковый обход user_id с постоянным расходом памяти"""
+    async for rows in iter_user_batches(after, batch_size, **filters):
+        for row in rows:
+            yield row[0]
+
+@_timed
+async def count_users(**filters) -> int:
+    where, params = _user_filters(**filters)
+    result = await _fetchone(f'SELECT COUNT(*) FROM users WHERE {where}', params)
+    return result[0]
+
+# === СТАТИСТИКА ===
+
+_stats_cache: Optional[Tuple[float, dict]] = None
+
+def _collect_stats(conn: sqlite3.Connection) -> dict:
+    # Один проход по таблице с агрегатами вместо выгрузки строк в Python
+    total, unreachable, active_day, active_week = conn.execute('''
+        SELECT COUNT(*),
+               COALESCE(SUM(unreachable_at IS NOT NULL), 0),
+               COALESCE(SUM(last_message_time >= datetime('now', '-1 day')), 0),
+               COALESCE(SUM(last_message_time >= datetime('now', '-7 days')), 0)
+        FROM users
+    ''').fetchone()
+    new_by_day = conn.execute('''
+        SELECT date(created_at), COUNT(*) FROM users
+        WHERE created_at >= date('now', '-6 days')
+        GROUP BY 1 ORDER BY 1 DESC
+    ''').fetchall()
+    return {
+        'total': total,
+        'unreachable': unreachable,
+        'active_day': active_day,
+        'active_week': active_week,
+        'new_by_day': new_by_day,
+    }
+
+@_timed
+async def get_stats(max_age: float = STATS_TTL) -> dict:
+    """
+    Сводная статистика по пользователям. Агрегаты кэшируются на max_age секунд,
+    число забаненных всегда берётся из черного списка в памяти.
+    """
+    global _stats_cache
+    now = time.monotonic()
+    if _stats_cache is None or now - _stats_cache[0] > max_age:
+        _stats_cache = (now, await _read(_collect_stats))
+    stats = dict(_stats_cache[1])
+    stats['banned'] = len(_banned_ids)
+    stats['cached_for'] = now - _stats_cache[0]
+    return stats
+
+@_timed
+async def get_user_by_username(username: str) -> Optional[Tuple[int, str, str]]:
+    return await _fetchone(
+        'SELECT user_id, username, first_name FROM users WHERE username = ? COLLATE NOCASE', (username,)
+    )
+
+@_timed
+async def get_user_by_id(user_id: int) -> Optional[Tuple]:
+    if user_id in _pending_users:
+        username, first_name, _ = _pending_users[user_id]
+        return user_id, username, first_name, int(is_user_banned(user_id))
+    return await _fetchone('SELECT user_id, username, first_name, is_banned FROM users WHERE user_id = ?', (user_id,))
+
+# === ОТЛОЖЕННАЯ ЗАПИСЬ (WRITE-BEHIND) ===
+# Регистрации (/start) и время активности не пишутся в БД сразу: они копятся
+# в памяти, повторы по одному пользователю схлопываются, и всё сбрасывается одной
+# транзакцией раз в WRITE_FLUSH_INTERVAL или по достижении WRITE_FLUSH_ROWS строк.
+
+_pending_users: Dict[int, Tuple[str, str, str]] = {}  # user_id -> (username, first_name, время)
+_pending_activity: Dict[int, str] = {}  # user_id -> время последнего сообщения
+_pending_unreachable: Dict[int, str] = {}  # user_id -> когда Telegram ответил 403
+_flush_requested: Optional[asyncio.Event] = None
+_write_behind_task: Optional[asyncio.Task] = None
+_write_behind_stopping = False
+
+def _utcnow() -> str:
+    """Текущее время в формате CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def _notify_writer():
+    if _flush_requested is not None and write_queue_depth() >= WRITE_FLUSH_ROWS:
+        _flush_requested.set()
+
+def touch_users(last_seen: List[Tuple[int, str]]):
+    """Ставит в очередь время последних сообщений: [(user_id, 'YYYY-MM-DD HH:MM:SS'), ...]"""
+    for user_id, seen_at in last_seen:
+        if user_id in _pending_users:
+            username, first_name, _ = _pending_users[user_id]
+            _pending_users[user_id] = (username, first_name, seen_at)
+        else:
+            _pending_activity[user_id] = seen_at
+        if _pending_unreachable.get(user_id, seen_at) < seen_at:
+            del _pending_unreachable[user_id]
+    _notify_writer()
+
+def mark_unreachable(user_id: int):
+    """Ставит в очередь отметку «заблокировал бота / удалил аккаунт»: рассылки его пропустят"""
+    _pending_unreachable[user_id] = _utcnow()
+    _notify_writer()
+
+def write_queue_depth() -> int:
+    return len(_pending_users) + len(_pending_activity) + len(_pending_unreachable)
+
+def _write_batch(conn: sqlite3.Connection, users: list, activity: list, unreachable: list):
+    # Сообщение от пользователя новее отметки о 403 означает, что он снова доступен
+    conn.executemany('''
+        INSERT INTO users (user_id, username, first_name, last_message_time)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_message_time = excluded.last_message_time,
+            unreachable_at = CASE WHEN unreachable_at <= excluded.last_message_time THEN NULL ELSE unreachable_at END
+    ''', users)
+    conn.executemany('''
+        UPDATE users SET
+            last_message_time = ?1,
+            unreachable_at = CASE WHEN unreachable_at <= ?1 THEN NULL ELSE unreachable_at END
+        WHERE user_id = ?2
+    ''', activity)
+    conn.executemany('UPDATE users SET unreachable_at = ? WHERE user_id = ?', unreachable)
+
+@_timed
+async def flush_writes():
+    """Сбрасывает накопленные изменения одной транзакцией"""
+    global _pending_users, _pending_activity, _pending_unreachable
+    if not write_queue_depth():
+        return
+    users, _pending_users = _pending_users, {}
+    activity, _pending_activity = _pending_activity, {}
+    unreachable, _pending_unreachable = _pending_unreachable, {}
+    try:
+        await _transaction(lambda conn: _write_batch(
+            conn,
+            [(user_id, username, first_name, seen_at) for user_id, (username, first_name, seen_at) in users.items()],
+            [(seen_at, user_id) for user_id, seen_at in activity.items()],
+            [(marked_at, user_id) for user_id, marked_at in unreachable.items()],
+        ))
+    except BaseException:
+        # Возвращаем пачку в очередь (в том числе при отмене задачи), не затирая
+        # более свежие данные; повторный upsert тех же значений безопасен
+        metrics.WRITE_FLUSHES.inc(result='error')
+        _pending_users = {**users, **_pending_users}
+        _pending_activity = {**activity, **_pending_activity}
+        _pending_unreachable = {**unreachable, **_pending_unreachable}
+        raise
+    metrics.WRITE_FLUSHES.inc(result='ok')
+    metrics.WRITE_FLUSHED_ROWS.inc(len(users) + len(activity) + len(unreachable))
+
+async def _write_behind_loop():
+    # Останавливается флагом, а не cancel(): в Python < 3.12 asyncio.wait_for теряет
+    # отмену, если событие выставлено в тот же момент, и цикл не завершался бы
+    while not _write_behind_stopping:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), WRITE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        try:
+            await flush_writes()
+        except Exception as e:
+            logging.warning(f"Отложенная запись в БД не удалась, повтор позже: {e}")
+
+def _start_write_behind():
+    global _flush_requested, _write_behind_task, _write_behind_stopping
+    if _write_behind_task is None:
+        _write_behind_stopping = False
+        _flush_requested = asyncio.Event()
+        _write_behind_task = asyncio.create_task(_write_behind_loop())
+
+async def _stop_write_behind():
+    global _write_behind_task, _write_behind_stopping
+    if _write_behind_task is not None:
+        _write_behind_stopping = True
+        _flush_requested.set()
+        await _write_behind_task
+        _write_behind_task = None
+    if _writer is not None:
+        await flush_writes()
 
 # === ЧЕРНЫЙ СПИСОК ===
+# Множество забаненных держится в памяти: загружается при старте и обновляется
+# вместе с таблицей (write-through), поэтому проверка бана не делает запросов к БД.
 
-def ban_user(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_banned = 1 WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+_banned_ids: Set[int] = set()
 
-def unban_user(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET is_banned = 0 WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+@_timed
+async def reload_banned() -> int:
+    """Перечитывает черный список из БД, возвращает число забаненных"""
+    global _banned_ids
+    # Читаем через поток-писатель: так перезагрузка упорядочена с ban_user/unban_user
+    rows = await _transaction(lambda conn: conn.execute('SELECT user_id FROM users WHERE is_banned = 1').fetchall())
+    _banned_ids = {row[0] for row in rows}
+    return len(_banned_ids)
+
+@_timed
+async def ban_user(user_id: int):
+    await flush_writes()  # пользователь мог быть ещё в очереди записи
+    if await _execute('UPDATE users SET is_banned = 1 WHERE user_id = ?', (user_id,)):
+        _banned_ids.add(user_id)
 
-def get_banned_users() -> List[Tuple[int, str, str]]:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, username, first_name FROM users WHERE is_banned = 1')
-    users = cursor.fetchall()
-    conn.close()
-    return users
+@_timed
+async def unban_user(user_id: int):
+    await flush_writes()
+    await _execute('UPDATE users SET is_banned = 0 WHERE user_id = ?', (user_id,))
+    _banned_ids.discard(user_id)
+
+def _apply_bans(conn: sqlite3.Connection, user_ids: List[int], banned: bool) -> Tuple[List[int], int, int]:
+    known: Dict[int, int] = {}
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        known.update(conn.execute(
+            f"SELECT user_id, is_banned FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    changed = [user_id for user_id in user_ids if user_id in known and bool(known[user_id]) != banned]
+    conn.executemany('UPDATE users SET is_banned = ? WHERE user_id = ?', [(int(banned), user_id) for user_id in changed])
+    return changed, len(known) - len(changed), len(user_ids) - len(known)
+
+async def _set_banned_many(user_ids: Collection[int], banned: bool) -> Tuple[List[int], int, int]:
+    await flush_writes()
+    changed, skipped, unknown = await _transaction(lambda conn: _apply_bans(conn, list(dict.fromkeys(user_ids)), banned))
+    # Реестр меняется целиком после COMMIT, без await посередине — хендлеры не увидят половину списка
+    if banned:
+        _banned_ids.update(changed)
+    else:
+        _banned_ids.difference_update(changed)
+    return changed, skipped, unknown
+
+@_timed
+async def ban_users(user_ids: Collection[int]) -> Tuple[List[int], int, int]:
+    """
+    Банит список пользователей одной транзакцией.
+    Возвращает (забаненные сейчас, уже были забанены, нет в базе).
+    """
+    return await _set_banned_many(user_ids, True)
+
+@_timed
+async def unban_users(user_ids: Collection[int]) -> Tuple[List[int], int, int]:
+    """Разбанивает список одной транзакцией: (разбаненные сейчас, не были забанены, нет в базе)"""
+    return await _set_banned_many(user_ids, False)
+
+@_timed
+async def get_banned_users(
+    after: int = 0,
+    before: Optional[int] = None,
+    limit: Optional[int] = None,
+    search: Optional[str] = None,
+) -> List[Tuple[int, str, str]]:
+    """
+    Забаненные по возрастанию user_id, keyset-страницами: after — следующая страница
+    после этого user_id, before — предыдущая перед ним. search — ID или начало username.
+    Без limit возвращает всех.
+    """
+    conditions, params = ['is_banned = 1'], []
+    if search:
+        search = search.lstrip('@')
+        if search.isdigit():
+            conditions.append('user_id = ?')
+            params.append(int(search))
+        else:
+            # LIKE в SQLite не учитывает регистр латиницы — как поиск по username в Telegram
+            conditions.append("username LIKE ? ESCAPE '\\'")
+            params.append(search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if before is not None:
+        conditions.append('user_id < ?')
+        params.append(before)
+        order = 'DESC'
+    else:
+        conditions.append('user_id > ?')
+        params.append(after)
+        order = 'ASC'
+    sql = f"SELECT user_id, username, first_name FROM users WHERE {' AND '.join(conditions)} ORDER BY user_id {order}"
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    rows = await _fetchall(sql, tuple(params))
+    return rows[::-1] if before is not None else rows
+
+def count_banned() -> int:
+    return len(_banned_ids)
 
 def is_user_banned(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result and result[0] == 1
\ No newline at end of file
+    return user_id in _banned_ids
+
+# === РАССЫЛКИ ===
+# Каждый получатель сначала помечается pending и только потом получает сообщение.
+# После перезапуска задание продолжается с cursor, а уже записанные получатели
+# (в том числе pending, чья отправка могла пройти) повторно не отправляются.
+
+@_timed
+async def create_broadcast(from_chat_id: int, message_id: int, total: int, filters: str = '{}') -> int:
+    """filters — фильтры аудитории (аргументы _user_filters) в JSON"""
+    def create(conn: sqlite3.Connection) -> int:
+        cursor = conn.execute(
+            'INSERT INTO broadcasts (from_chat_id, message_id, total, filters) VALUES (?, ?, ?, ?)',
+            (from_chat_id, message_id, total, filters)
+        )
+        return cursor.lastrowid
+    return await _transaction(create)
+
+@_timed
+async def get_broadcast(broadcast_id: int) -> Optional[Tuple[int, int, int, str, int, int, str]]:
+    """(id, from_chat_id, message_id, status, cursor, total, filters)"""
+    return await _fetchone(
+        'SELECT id, from_chat_id, message_id, status, cursor, total, filters FROM broadcasts WHERE id = ?',
+        (broadcast_id,)
+    )
+
+@_timed
+async def get_unfinished_broadcasts() -> List[Tuple[int, int, int, str, int, int, str]]:
+    return await _fetchall(
+        "SELECT id, from_chat_id, message_id, status, cursor, total, filters FROM broadcasts "
+        "WHERE status IN ('running', 'paused') ORDER BY id"
+    )
+
+@_timed
+async def set_broadcast_status(broadcast_id: int, status: str):
+    """running / paused — состояние незавершённой рассылки"""
+    await _execute('UPDATE broadcasts SET status = ? WHERE id = ?', (status, broadcast_id))
+
+@_timed
+async def claim_recipients(broadcast_id: int, user_ids: List[int], cursor: int) -> List[int]:
+    """
+    Помечает получателей как pending и сдвигает cursor задания.
+    Возвращает только тех, кто ещё не был записан в этой рассылке.
+    """
+    new_cursor = cursor
+
+    def claim(conn: sqlite3.Connection) -> List[int]:
+        claimed = []
+        for user_id in user_ids:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)',
+                (broadcast_id, user_id)
+            )
+            if cursor.rowcount:
+                claimed.append(user_id)
+        conn.execute(
+            'UPDATE broadcasts SET cursor = MAX(cursor, ?) WHERE id = ?',
+            (new_cursor, broadcast_id)
+        )
+        return claimed
+    return await _transaction(claim)
+
+@_timed
+async def release_recipients(broadcast_id: int, after: int) -> int:
+    """
+    Возвращает в очередь получателей с user_id > after, помеченных pending, но не
+    получивших рассылку (штатная остановка бота): строки удаляются, cursor задания
+    откатывается перед первым из них. Возвращает число освобождённых.
+    """
+    def release(conn: sqlite3.Connection) -> int:
+        first = conn.execute(
+            "SELECT MIN(user_id) FROM broadcast_recipients "
+            "WHERE broadcast_id = ? AND status = 'pending' AND user_id > ?",
+            (broadcast_id, after)
+        ).fetchone()[0]
+        if first is None:
+            return 0
+        deleted = conn.execute(
+            "DELETE FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending' AND user_id > ?",
+            (broadcast_id, after)
+        ).rowcount
+        conn.execute('UPDATE broadcasts SET cursor = MIN(cursor, ?) WHERE id = ?', (first - 1, broadcast_id))
+        return deleted
+    return await _transaction(release)
+
+@_timed
+async def record_broadcast_results(broadcast_id: int, results: List[Tuple[int, bool]]):
+    """Сохраняет итоги отправки пачкой: [(user_id, успех), ...]"""
+    if not results:
+        return
+    await _transaction(lambda conn: conn.executemany(
+        'UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?',
+        [('sent' if ok else 'failed', broadcast_id, user_id) for user_id, ok in results]
+    ))
+
+@_timed
+async def get_broadcast_counts(broadcast_id: int) -> dict:
+    """Число получателей по статусам: {'sent': ..., 'failed': ..., 'pending': ...}"""
+    rows = await _fetchall(
+        'SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status',
+        (broadcast_id,)
+    )
+    return dict(rows)
+
+@_timed
+async def delete_finished_recipients(finished_before: str) -> int:
+    """
+    Удаляет строки получателей завершённых и отменённых рассылок, законченных
+    раньше finished_before ('YYYY-MM-DD HH:MM:SS' UTC). Сами задания остаются.
+    """
+    return await _execute(
+        "DELETE FROM broadcast_recipients WHERE broadcast_id IN ("
+        "SELECT id FROM broadcasts WHERE status IN ('done', 'cancelled') AND finished_at < ?)",
+        (finished_before,)
+    )
+
+@_timed
+async def finish_broadcast(broadcast_id: int, status: str = 'done'):
+    await _execute(
+        'UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (status, broadcast_id)
+    )
+
+# === ОТЛОЖЕННЫЕ СООБЩЕНИЯ ===
+# due_at — unix-время отправки. Индекс по due_at служит очередью с приоритетом.
+
+@_timed
+async def schedule_message(user_id: int, kind: str, due_at: float) -> bool:
+    """Ставит сообщение в очередь, возвращает False, если такое уже ожидает отправки"""
+    rowcount = await _execute(
+        'INSERT OR IGNORE INTO scheduled_messages (user_id, kind, due_at) VALUES (?, ?, ?)',
+        (user_id, kind, due_at)
+    )
+    return rowcount > 0
+
+@_timed
+async def schedule_messages(rows: List[Tuple[int, str, float]]) -> int:
+    """Пачка сообщений [(user_id, kind, due_at)] одной транзакцией, возвращает число добавленных"""
+    def insert(conn: sqlite3.Connection) -> int:
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO scheduled_messages (user_id, kind, due_at) VALUES (?, ?, ?)', rows)
+        return conn.total_changes - before
+    return await _transaction(insert) if rows else 0
+
+@_timed
+async def get_next_due_time() -> Optional[float]:
+    result = await _fetchone('SELECT MIN(due_at) FROM scheduled_messages')
+    return result[0]
+
+@_timed
+async def get_due_messages(now: float, limit: int) -> List[Tuple[int, int, str]]:
+    """(id, user_id, kind) для сообщений, время которых наступило"""
+    return await _fetchall(
+        'SELECT id, user_id, kind FROM scheduled_messages WHERE due_at <= ? ORDER BY due_at LIMIT ?',
+        (now, limit)
+    )
+
+@_timed
+async def delete_scheduled(ids: List[int]):
+    if not ids:
+        return
+    await _transaction(lambda conn: conn.executemany(
+        'DELETE FROM scheduled_messages WHERE id = ?', [(message_id,) for message_id in ids]
+    ))
+
+@_timed
+async def count_scheduled(kind: Optional[str] = None) -> int:
+    if kind is None:
+        result = await _fetchone('SELECT COUNT(*) FROM scheduled_messages')
+    else:
+        result = await _fetchone('SELECT COUNT(*) FROM scheduled_messages WHERE kind = ?', (kind,))
+    return result[0]
+
+# === СОСТОЯНИЯ FSM ===
+
+@_timed
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str, float]]:
+    """(state, data в JSON, updated_at)"""
+    return await _fetchone('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+
+@_timed
+async def get_fsm_keys() -> List[str]:
+    """Ключи всех сохранённых состояний"""
+    return [row[0] for row in await _fetchall('SELECT key FROM fsm_states')]
+
+@_timed
+async def set_fsm_state(key: str, state: Optional[str]):
+    await _execute('''
+        INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', (key, state, time.time()))
+
+@_timed
+async def set_fsm_data(key: str, data: str):
+    await _execute('''
+        INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    ''', (key, data, time.time()))
+
+@_timed
+async def delete_fsm_states(key: Optional[str] = None, updated_before: Optional[float] = None) -> int:
+    """Удаляет состояние по ключу или все, что не менялись с updated_before"""
+    if key is not None:
+        return await _execute('DELETE FROM fsm_states WHERE key = ?', (key,))
+    return await _execute('DELETE FROM fsm_states WHERE updated_at < ?', (updated_before,))
+
+# === ОТВЕТЫ АДМИНА РЕПЛАЕМ ===
+# Сообщение с вопросом в чате админа -> пользователь (для дайджеста — несколько).
+# Последние записи держатся в LRU-кэше, так что ответ реплаем обычно не идёт в БД.
+
+_reply_cache: 'OrderedDict[int, Tuple[int, ...]]' = OrderedDict()
+
+def _cache_reply_targets(message_id: int, user_ids: Tuple[int, ...]):
+    _reply_cache[message_id] = user_ids
+    _reply_cache.move_to_end(message_id)
+    while len(_reply_cache) > REPLY_CACHE_SIZE:
+        _reply_cache.popitem(last=False)
+
+@_timed
+async def save_admin_messages(pairs: List[Tuple[int, int]]):
+    """Запоминает пары (message_id в чате админа, user_id)"""
+    if not pairs:
+        return
+    now = time.time()
+    await _transaction(lambda conn: conn.executemany(
+        'INSERT OR IGNORE INTO admin_messages (message_id, user_id, created_at) VALUES (?, ?, ?)',
+        [(message_id, user_id, now) for message_id, user_id in pairs]
+    ))
+    targets: Dict[int, List[int]] = {}
+    for message_id, user_id in pairs:
+        targets.setdefault(message_id, []).append(user_id)
+    for message_id, user_ids in targets.items():
+        _cache_reply_targets(message_id, tuple(user_ids))
+
+@_timed
+async def get_reply_targets(message_id: int) -> Tuple[int, ...]:
+    """Пользователи, которым адресован ответ на сообщение message_id (пусто — неизвестно)"""
+    cached = _reply_cache.get(message_id)
+    if cached is not None:
+        _reply_cache.move_to_end(message_id)
+        return cached
+    rows = await _fetchall('SELECT user_id FROM admin_messages WHERE message_id = ?', (message_id,))
+    targets = tuple(row[0] for row in rows)
+    if targets:
+        _cache_reply_targets(message_id, targets)
+    return targets
+
+@_timed
+async def delete_admin_messages(created_before: float) -> int:
+    """Забывает старые сообщения с вопросами: ответить на них реплаем уже не выйдет"""
+    count = await _execute('DELETE FROM admin_messages WHERE created_at < ?', (created_before,))
+    if count:
+        _reply_cache.clear()
+    return count
+
+# === ОБСЛУЖИВАНИЕ ===
+# Резервная копия делается онлайн-бэкапом SQLite из потока-читателя: в режиме WAL
+# читатель видит согласованный снимок и не мешает писателю. Остальные операции
+# идут через поток-писатель, чтобы не конкурировать с записью за блокировку.
+
+def _backup_sync(path: str) -> int:
+    target = sqlite3.connect(path)
+    try:
+        _get_conn().backup(target)
+        result = target.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            raise sqlite3.DatabaseError(f"Копия повреждена: {result}")
+        return target.execute('PRAGMA page_count').fetchone()[0] * target.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        target.close()
+
+@_timed
+async def backup(path: str) -> int:
+    """Согласованная копия БД в path (с проверкой quick_check), возвращает её размер в байтах"""
+    return await _run(_readers, _backup_sync, path)
+
+@_timed
+async def checkpoint(mode: str = 'PASSIVE') -> Tuple[int, int, int]:
+    """Переносит WAL в основной файл: (busy, страниц в WAL, перенесено). TRUNCATE ещё и обнуляет WAL"""
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f"Неизвестный режим checkpoint: {mode}")
+    return await _run(_writer, _fetchone_sync, f'PRAGMA wal_checkpoint({mode})', ())
+
+@_timed
+async def analyze():
+    """Обновляет статистику планировщика запросов (с ограничением, чтобы не читать всю таблицу)"""
+    def run(conn: sqlite3.Connection):
+        conn.execute('PRAGMA analysis_limit = 1000')
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
+    await _transaction(run)
+
+@_timed
+async def get_auto_vacuum() -> int:
+    """Режим auto_vacuum: 0 — NONE, 1 — FULL, 2 — INCREMENTAL"""
+    # Читатели могут помнить режим до перевода, точный — у писателя
+    return (await _run(_writer, _fetchone_sync, 'PRAGMA auto_vacuum', ()))[0]
+
+@_timed
+async def enable_incremental_vacuum() -> bool:
+    """
+    Переводит существующую БД в auto_vacuum=INCREMENTAL. Для этого нужен полный
+    VACUUM: файл переписывается целиком и запись на это время стоит, поэтому
+    перевод запускается только явно. Возвращает False, если режим уже включён.
+    """
+    def run() -> bool:
+        conn = _get_conn()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        started = time.perf_counter()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        logging.info(f"БД переведена в auto_vacuum=INCREMENTAL за {time.perf_counter() - started:.1f} с")
+        return True
+    return await _run(_writer, run)
+
+@_timed
+async def incremental_vacuum(max_pages: int = 0) -> int:
+    """Возвращает ОС свободные страницы (0 — все), возвращает число освобождённых"""
+    def run() -> int:
+        conn = _get_conn()
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({int(max_pages)})').fetchall()
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return await _run(_writer, run)
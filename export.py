@@ -0,0 +1,53 @@
+import asyncio
+import csv
+import gzip
+import json
+import logging
+from typing import IO, List, Tuple
+
+import database as db
+from broadcast import segment_filters
+
+# === ВЫГРУЗКА ПОЛЬЗОВАТЕЛЕЙ ===
+# Таблица users читается пачками по курсору user_id из пула читателей и сразу
+# дописывается в gzip-файл, поэтому память не растёт с числом строк. Сжатие и
+# запись на диск идут в отдельном потоке, event loop продолжает обрабатывать апдейты.
+
+EXPORT_COLUMNS = (
+    'user_id', 'username', 'first_name', 'is_banned', 'created_at', 'last_message_time', 'unreachable_at',
+)
+EXPORT_BATCH = 2000  # строк за одно чтение из БД
+FORMATS = ('csv', 'jsonl')
+
+def _open(path: str) -> IO[str]:
+    return gzip.open(path, 'wt', encoding='utf-8', newline='')
+
+def _write_csv(file: IO[str], rows: List[Tuple]):
+    csv.writer(file).writerows(rows)
+
+def _write_jsonl(file: IO[str], rows: List[Tuple]):
+    file.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+
+async def export_users(path: str, fmt: str = 'csv', segment: str = 'all') -> int:
+    """
+    Пишет пользователей сегмента в path (gzip) в формате csv или jsonl.
+    Возвращает число выгруженных строк. ValueError — неверный формат или сегмент.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    filters = segment_filters(segment, recipients_only=False)
+    write = _write_csv if fmt == 'csv' else _write_jsonl
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(None, _open, path)
+    count = 0
+    try:
+        if fmt == 'csv':
+            await loop.run_in_executor(None, _write_csv, file, [EXPORT_COLUMNS])
+        batches = db.iter_user_batches(batch_size=EXPORT_BATCH, columns=', '.join(EXPORT_COLUMNS), **filters)
+        async for rows in batches:
+            await loop.run_in_executor(None, write, file, rows)
+            count += len(rows)
+    finally:
+        await loop.run_in_executor(None, file.close)
+    logging.info(f"Выгрузка пользователей ({fmt}, {segment}): {count} строк в {path}")
+    return count
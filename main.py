@@ -1,15 +1,40 @@
 import asyncio
+import html
 import logging
 import re
+import signal
+from typing import Dict, List, Optional, Set
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart, Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import CommandStart, Command, StateFilter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, FSInputFile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
 import os
+import tempfile
+from datetime import datetime
 import database as db
+import export
+import maintenance
+from ratelimit import create_limiter
+import broadcast
+from broadcast import Broadcaster, BroadcastStats, JobControl
+import outbound
+from outbound import Outbound, OutboundMiddleware
+from scheduler import Scheduler
+from middlewares import (
+    AccessMiddleware, ApiMetricsMiddleware, HandlerMetricsMiddleware, InFlightMiddleware, ReachabilityMiddleware,
+    UserAccess
+)
+import metrics
+from webhook import WebhookServer
+from notifier import AdminNotifier, Question, DIGEST_WINDOW
+from storage import SQLiteStorage, FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_STATE_TTL
 
 # Загружаем переменные из .env
 load_dotenv()
@@ -19,14 +44,59 @@ API_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID'))
 SITE_URL = os.getenv('SITE_URL', 'https://app.maryrose.by/').strip()
 FOLLOWUP_DELAY = 60
-SPAM_DELAY_SECONDS = 5  # Задержка между сообщениями пользователя
+SPAM_DELAY_SECONDS = int(os.getenv('SPAM_DELAY_SECONDS', 5))  # Окно анти-спама, сек
+SPAM_BURST = int(os.getenv('SPAM_BURST', 1))  # Сколько сообщений можно отправить за окно
+SPAM_LIMITER = os.getenv('SPAM_LIMITER', 'window')  # window — скользящее окно, bucket — token bucket
+ACTIVITY_FLUSH_SECONDS = 30  # Как часто сбрасывать время последних сообщений в БД
+QUESTION_DIGEST_WINDOW = float(os.getenv('QUESTION_DIGEST_WINDOW', DIGEST_WINDOW))  # Окно сбора вопросов в дайджест, сек
+BANNED_PAGE_SIZE = int(os.getenv('BANNED_PAGE_SIZE', 20))  # Забаненных на одной странице списка
+BAN_FILE_MAX_BYTES = 5 * 1024 * 1024  # Максимальный размер файла со списком ID для бана
+EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Лимит Bot API на отправку документа
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Обязателен в режиме webhook: без него апдейты могут подделать
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))  # Апдейтов, обрабатываемых одновременно
+BOT_API_URL = os.getenv('BOT_API_URL')  # Свой сервер Bot API (локальный или тестовый)
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))  # /metrics для Prometheus, 0 — выключить
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', outbound.GLOBAL_RATE))  # Сообщений в секунду на бота
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', outbound.CHAT_RATE))  # Сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', outbound.CHAT_BURST))  # Сообщений в чат подряд без ожидания
+DB_INCREMENTAL_VACUUM = os.getenv('DB_INCREMENTAL_VACUUM', '0') == '1'  # Перевести БД в auto_vacuum=INCREMENTAL при старте (разовый полный VACUUM)
+API_CONNECTIONS = int(os.getenv('API_CONNECTIONS', 100))  # Соединений с Bot API в пуле сессии
+# Сколько секунд после SIGTERM доделывать начатое; docker compose ждёт 10 с (stop_grace_period), потом SIGKILL
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 8))
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+# Одна сессия и один пул соединений на все отправки бота
+session = AiohttpSession(limit=API_CONNECTIONS)
+if BOT_API_URL:
+    session.api = TelegramAPIServer.from_base(BOT_API_URL)
+bot = Bot(token=API_TOKEN, session=session)
+# Все исходящие сообщения ждут слота в одном диспетчере: общий темп, темп на чат и полосы приоритета
+outbound_dispatcher = Outbound(rate=OUTBOUND_RATE, chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST)
+bot.session.middleware(OutboundMiddleware(outbound_dispatcher))
+bot.session.middleware(ApiMetricsMiddleware())
+bot.session.middleware(ReachabilityMiddleware())
+fsm_storage = SQLiteStorage(
+    cache_ttl=float(os.getenv('FSM_CACHE_TTL', FSM_CACHE_TTL)),
+    state_ttl=float(os.getenv('FSM_STATE_TTL', FSM_STATE_TTL)),
+    cache_size=int(os.getenv('FSM_CACHE_SIZE', FSM_CACHE_SIZE)),
+)
+dp = Dispatcher(storage=fsm_storage)
+spam_limiter = create_limiter(SPAM_LIMITER, window=SPAM_DELAY_SECONDS, burst=SPAM_BURST)
+broadcaster = Broadcaster(bot)
+scheduler = Scheduler()
+db_maintenance = maintenance.from_env()
+admin_notifier = AdminNotifier(bot, ADMIN_ID, window=QUESTION_DIGEST_WINDOW)
 
 # === МАШИНА СОСТОЯНИЙ (FSM) ===
 class AdminState(StatesGroup):
@@ -34,6 +104,7 @@ class AdminState(StatesGroup):
     waiting_for_username = State()
     waiting_for_ban = State()        # Режим бана по ID
     waiting_for_unban = State()      # Режим разбана по ID
+    waiting_for_ban_search = State() # Поиск в черном списке
 
 # === КЛАВИАТУРЫ ===
 
@@ -64,23 +135,47 @@ def get_ban_unban_keyboard():
         [KeyboardButton(text="❌ Назад")]
     ], resize_keyboard=True)
 
+def get_segment_keyboard(selected: str):
+    buttons = [
+        InlineKeyboardButton(text=("✅ " if segment == selected else "") + title, callback_data=f"seg:{segment}")
+        for segment, title in broadcast.SEGMENTS.items()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+def get_broadcast_control_keyboard(job_id: int, control: JobControl):
+    if control.cancelled:
+        return None
+    if control.paused:
+        toggle = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bc:resume:{job_id}")
+    else:
+        toggle = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bc:pause:{job_id}")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, InlineKeyboardButton(text="⏹ Отменить", callback_data=f"bc:cancel:{job_id}")]
+    ])
+
 # === ПРОВЕРКА НА БАН И СПАМ (MIDDLEWARE) ===
 
-async def check_user_access(message: types.Message) -> bool:
-    """Проверяет, забанен ли пользователь и не спамит ли он"""
-    user_id = message.from_user.id
-    
+inflight = InFlightMiddleware()
+dp.update.outer_middleware(inflight)
+access_middleware = AccessMiddleware(ADMIN_ID, spam_limiter)
+dp.message.outer_middleware(access_middleware)
+dp.callback_query.outer_middleware(access_middleware)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+async def check_user_access(message: types.Message, access: UserAccess) -> bool:
+    """Сообщает пользователю, если он забанен или спамит (проверки уже сделаны в middleware)"""
     # Админа не проверяем
-    if user_id == ADMIN_ID:
+    if access.is_admin:
         return True
     
     # Проверка на бан
-    if db.is_user_banned(user_id):
+    if access.is_banned:
         await message.answer("🚫 Вы заблокированы в этом боте.\nОбратитесь к администрации для разблокировки.")
         return False
     
     # Проверка на спам
-    if db.check_spam(user_id, SPAM_DELAY_SECONDS):
+    if access.is_spam:
         await message.answer(f"⏳ Пожалуйста, подождите {SPAM_DELAY_SECONDS} секунд между сообщениями.")
         return False
     
@@ -89,8 +184,8 @@ async def check_user_access(message: types.Message) -> bool:
 # === ХЕНДЛЕРЫ АДМИНИСТРАТОРА ===
 
 @dp.message(Command("admin"))
-async def cmd_admin(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+async def cmd_admin(message: types.Message, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
@@ -102,8 +197,8 @@ async def cmd_admin(message: types.Message):
 # --- 1. РАССЫЛКА ---
 
 @dp.message(F.text == "📢 Рассылка новостей")
-async def start_broadcast_button(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def start_broadcast_button(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
@@ -112,10 +207,59 @@ async def start_broadcast_button(message: types.Message, state: FSMContext):
         reply_markup=get_cancel_keyboard()
     )
     await state.set_state(AdminState.waiting_for_broadcast)
+    await state.update_data(segment='all')
+    await message.answer(
+        await format_audience('all'),
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_segment_keyboard('all')
+    )
+
+async def format_audience(segment: str) -> str:
+    """Пробный подсчёт аудитории сегмента — до отправки"""
+    count = await broadcast.count_audience(segment, exclude_ids={ADMIN_ID})
+    return (
+        f"👥 <b>Аудитория:</b> {broadcast.segment_title(segment)} — {count} получателей\n\n"
+        "<i>Заблокировавшие бота пропускаются. Свой сегмент: /audience active:14, "
+        "/audience new:3 или /audience joined:2025-01-31</i>"
+    )
+
+@dp.callback_query(F.data.startswith("seg:"), AdminState.waiting_for_broadcast)
+async def select_segment_callback(callback: types.CallbackQuery, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
+        await callback.answer()
+        return
+    
+    segment = callback.data[len("seg:"):]
+    await state.update_data(segment=segment)
+    await callback.message.edit_text(
+        await format_audience(segment),
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_segment_keyboard(segment)
+    )
+    await callback.answer()
+
+@dp.message(AdminState.waiting_for_broadcast, Command("audience"))
+async def select_custom_segment(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
+        return
+    
+    segment = (message.text.split(maxsplit=1)[1:] or ['all'])[0].strip()
+    try:
+        text = await format_audience(segment)
+    except ValueError:
+        await message.answer(
+            "⚠️ <b>Неизвестный сегмент!</b>\n\n"
+            "Примеры: <code>/audience active:14</code>, <code>/audience new:3</code>, "
+            "<code>/audience joined:2025-01-31</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    await state.update_data(segment=segment)
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=get_segment_keyboard(segment))
 
 @dp.message(AdminState.waiting_for_broadcast)
-async def process_broadcast(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def process_broadcast(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
     if message.text and message.text == "❌ Отмена":
@@ -123,44 +267,137 @@ async def process_broadcast(message: types.Message, state: FSMContext):
         await message.answer("❌ Рассылка отменена.", reply_markup=get_admin_keyboard())
         return
     
-    await message.answer("⏳ Рассылка запущена...")
-    
-    users = db.get_all_users()
-    count = 0
-    failed = 0
-    
-    for user in users:
-        user_id = user[0]
-        if user_id == ADMIN_ID:
-            continue
-        try:
-            await message.copy_to(chat_id=user_id)
-            count += 1
-        except Exception as e:
-            failed += 1
-            logging.warning(f"Не удалось отправить пользователю {user_id}: {e}")
-        
-        await asyncio.sleep(0.05)
+    segment = (await state.get_data()).get('segment', 'all')
+    job = await broadcast.start_job(message.chat.id, message.message_id, exclude_ids={ADMIN_ID}, segment=segment)
+    start_broadcast_task(job)
     
     await message.answer(
-        f"✅ <b>Готово!</b>\n\nОтправлено: {count}\nОшибок: {failed}",
+        f"⏳ <b>Рассылка #{job[0]} запущена в фоне.</b>\n\n"
+        f"Аудитория: {broadcast.segment_title(segment)} — {job[5]} получателей.\n"
+        "Прогресс будет обновляться в отдельном сообщении.",
         reply_markup=get_admin_keyboard(),
         parse_mode=ParseMode.HTML
     )
     await state.clear()
 
+# Выполняющиеся в фоне рассылки: id задания -> управление паузой/отменой
+active_broadcasts: Dict[int, JobControl] = {}
+broadcast_tasks: Set[asyncio.Task] = set()
+
+def start_broadcast_task(job) -> asyncio.Task:
+    control = JobControl(paused=job[3] == 'paused')
+    active_broadcasts[job[0]] = control
+    # Прогресс и итог — уведомления админу; сами сообщения рассылки уходят в полосе bulk
+    with outbound.lane(outbound.NOTIFY):
+        task = asyncio.create_task(run_broadcast_job(job, control))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
+    return task
+
+def format_broadcast_progress(job_id: int, stats: BroadcastStats, control: JobControl) -> str:
+    if control.cancelled:
+        title = f"⏹ <b>Рассылка #{job_id} отменяется...</b>"
+    elif control.paused:
+        title = f"⏸ <b>Рассылка #{job_id} на паузе</b>"
+    else:
+        title = f"⏳ <b>Рассылка #{job_id} идёт</b>"
+    return f"{title}\n\nВсего: {stats.total}\n{stats.format()}"
+
+async def run_broadcast_job(job, control: JobControl):
+    """Фоновое выполнение рассылки с живым сообщением о прогрессе"""
+    job_id = job[0]
+    progress = await bot.send_message(
+        chat_id=ADMIN_ID,
+        text=f"⏳ <b>Рассылка #{job_id} начинается...</b>",
+        reply_markup=get_broadcast_control_keyboard(job_id, control),
+        parse_mode=ParseMode.HTML
+    )
+    last_text = progress.text
+    
+    async def update_progress(stats: BroadcastStats):
+        nonlocal last_text
+        text = format_broadcast_progress(job_id, stats, control)
+        if text == last_text:
+            return
+        await bot.edit_message_text(
+            text=text,
+            chat_id=ADMIN_ID,
+            message_id=progress.message_id,
+            reply_markup=get_broadcast_control_keyboard(job_id, control),
+            parse_mode=ParseMode.HTML
+        )
+        last_text = text
+    
+    try:
+        stats = await broadcast.run_job(
+            broadcaster, job,
+            exclude_ids={ADMIN_ID},
+            on_progress=update_progress,
+            control=control
+        )
+    except Exception as e:
+        logging.exception(f"Рассылка #{job_id} прервана: {e}")
+        await bot.send_message(chat_id=ADMIN_ID, text=f"❌ Рассылка #{job_id} прервана ошибкой: {e}")
+        return
+    finally:
+        active_broadcasts.pop(job_id, None)
+    
+    if control.cancelled:
+        title = f"⏹ <b>Рассылка #{job_id} отменена</b>"
+    elif control.stopped:
+        title = f"🔄 <b>Рассылка #{job_id} прервана перезапуском бота</b> — продолжится после старта"
+    else:
+        title = f"✅ <b>Рассылка #{job_id} завершена!</b>"
+    await bot.edit_message_text(
+        text=f"{title}\n\n"
+             f"Отправлено: {stats.sent}\n"
+             f"Ошибок: {stats.failed} (заблокировали бота: {stats.unreachable})\n"
+             f"Время: {stats.elapsed:.0f} с ({stats.rate:.1f} сообщ./с)",
+        chat_id=ADMIN_ID,
+        message_id=progress.message_id,
+        parse_mode=ParseMode.HTML
+    )
+
+@dp.callback_query(F.data.startswith("bc:"))
+async def broadcast_control_callback(callback: types.CallbackQuery, access: UserAccess):
+    if not access.is_admin:
+        await callback.answer()
+        return
+    
+    _, action, job_id = callback.data.split(":")
+    job_id = int(job_id)
+    control = active_broadcasts.get(job_id)
+    if control is None:
+        await callback.answer("Рассылка уже завершена.", show_alert=True)
+        return
+    
+    if action == "pause":
+        control.pause()
+        await db.set_broadcast_status(job_id, 'paused')
+        await callback.answer("⏸ Пауза")
+    elif action == "resume":
+        control.resume()
+        await db.set_broadcast_status(job_id, 'running')
+        await callback.answer("▶️ Продолжаем")
+    elif action == "cancel":
+        control.cancel()
+        await callback.answer("⏹ Рассылка будет остановлена")
+    
+    await callback.message.edit_reply_markup(reply_markup=get_broadcast_control_keyboard(job_id, control))
+
 # --- 2. ЛИЧНОЕ СООБЩЕНИЕ ---
 
 @dp.message(F.text == "✉️ Написать пользователю")
-async def start_personal_message(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def start_personal_message(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
         "✍️ <b>Введите данные в формате:</b>\n\n"
-        "<code>@username сообщение</code>\n\n"
+        "<code>@username сообщение</code> или <code>ID сообщение</code>\n\n"
         "Пример:\n"
         "<code>@ivan_privet Привет, это Мэри!</code>\n\n"
+        "<i>На вопрос пользователя проще ответить реплаем на его сообщение.</i>\n"
         "Напишите /cancel для отмены.",
         parse_mode=ParseMode.HTML,
         reply_markup=get_cancel_keyboard()
@@ -168,8 +405,8 @@ async def start_personal_message(message: types.Message, state: FSMContext):
     await state.set_state(AdminState.waiting_for_username)
 
 @dp.message(AdminState.waiting_for_username)
-async def process_username_input(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def process_username_input(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
     if message.text and message.text == "❌ Отмена":
@@ -178,19 +415,20 @@ async def process_username_input(message: types.Message, state: FSMContext):
         return
     
     text = message.text.strip()
-    match = re.search(r'@(\w+)', text)
+    # Адресат — @username или числовой ID в начале (у пользователя может не быть username)
+    match = re.search(r'@(\w+)', text) or re.match(r'(\d+)\b', text)
     
     if not match:
         await message.answer(
             "⚠️ <b>Не найден юзернейм!</b>\n\n"
-            "Сообщение должно содержать @username\n"
+            "Сообщение должно содержать @username или ID пользователя\n"
             "Пример: <code>@ivan_privet Привет</code>",
             parse_mode=ParseMode.HTML,
             reply_markup=get_cancel_keyboard()
         )
         return
     
-    username = match.group(1)
+    recipient = match.group(0)
     message_text = text[match.end():].strip()
     
     if not message_text:
@@ -202,11 +440,14 @@ async def process_username_input(message: types.Message, state: FSMContext):
         )
         return
     
-    user = db.get_user_by_username(username)
+    if recipient.startswith('@'):
+        user = await db.get_user_by_username(recipient[1:])
+    else:
+        user = await db.get_user_by_id(int(recipient))
     
     if not user:
         await message.answer(
-            f"❌ <b>Пользователь @{username} не найден в базе!</b>",
+            f"❌ <b>Пользователь {recipient} не найден в базе!</b>",
             parse_mode=ParseMode.HTML,
             reply_markup=get_cancel_keyboard()
         )
@@ -214,6 +455,7 @@ async def process_username_input(message: types.Message, state: FSMContext):
     
     user_id = user[0]
     user_name = user[2] or "Пользователь"
+    username = f"@{user[1]}" if user[1] else "нет username"
     
     try:
         await bot.send_message(
@@ -224,7 +466,7 @@ async def process_username_input(message: types.Message, state: FSMContext):
         
         await message.answer(
             f"✅ <b>Сообщение отправлено!</b>\n\n"
-            f"Пользователь: {user_name} (@{username})\n"
+            f"Пользователь: {user_name} ({username})\n"
             f"ID: <code>{user_id}</code>",
             parse_mode=ParseMode.HTML,
             reply_markup=get_admin_keyboard()
@@ -238,11 +480,52 @@ async def process_username_input(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+# --- 2.1. ОТВЕТ РЕПЛАЕМ НА ВОПРОС ---
+
+async def deliver_admin_reply(message: types.Message, user_id: int, text: str = None):
+    """Передаёт ответ админа пользователю: текст — с заголовком, остальное — копией"""
+    try:
+        if text is not None:
+            await bot.send_message(
+                chat_id=user_id,
+                text=f"📩 <b>Сообщение от администрации:</b>\n\n{text}",
+                parse_mode=ParseMode.HTML
+            )
+        else:
+            await message.copy_to(chat_id=user_id)
+    except Exception as e:
+        await message.reply(f"❌ <b>Ошибка отправки!</b>\n\n{html.escape(str(e))}", parse_mode=ParseMode.HTML)
+        return
+    await message.reply(f"✅ Ответ отправлен пользователю <code>{user_id}</code>.", parse_mode=ParseMode.HTML)
+
+@dp.message(F.reply_to_message, F.from_user.id == ADMIN_ID, StateFilter(None))
+async def process_admin_reply(message: types.Message, access: UserAccess):
+    """Админ отвечает реплаем на пересланный вопрос — адресат берётся из индекса сообщений"""
+    targets = await db.get_reply_targets(message.reply_to_message.message_id)
+    if not targets:
+        raise SkipHandler()  # реплай не на вопрос — пусть обработают остальные хендлеры
+    
+    if len(targets) == 1:
+        await deliver_admin_reply(message, targets[0], message.html_text if message.text else None)
+        return
+    
+    # Дайджест: адресата указывают ID в начале ответа
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) in targets:
+        await deliver_admin_reply(message, int(parts[0]), html.escape(parts[1]))
+        return
+    await message.reply(
+        "⚠️ <b>В этом сообщении вопросы нескольких пользователей.</b>\n\n"
+        "Начните ответ с ID пользователя, например:\n"
+        f"<code>{targets[0]} Спасибо за вопрос!</code>",
+        parse_mode=ParseMode.HTML
+    )
+
 # --- 3. БАН / РАЗБАН ---
 
 @dp.message(F.text == "🚫 Бан / Разбан")
-async def ban_unban_menu(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+async def ban_unban_menu(message: types.Message, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
@@ -251,165 +534,230 @@ async def ban_unban_menu(message: types.Message):
         parse_mode=ParseMode.HTML
     )
 
+BAN_LIST_HINT = (
+    "Можно несколько ID через пробел или с новой строки, "
+    "либо файл .txt / .csv (ID — в первой колонке).\n\n"
+    "Напишите /cancel для отмены."
+)
+
+def parse_user_ids(text: str, first_column: bool = False) -> List[int]:
+    """ID из текста; для файлов берётся только первая колонка каждой строки"""
+    if not first_column:
+        return [int(value) for value in re.findall(r'\d+', text)]
+    ids = []
+    for line in text.splitlines():
+        field = re.split(r'[,;\t ]', line.strip(), maxsplit=1)[0].strip('"\'')
+        if field.isdigit():
+            ids.append(int(field))
+    return ids
+
+async def read_user_ids(message: types.Message) -> List[int]:
+    if message.document:
+        if message.document.file_size and message.document.file_size > BAN_FILE_MAX_BYTES:
+            return []
+        content = await bot.download(message.document)
+        return parse_user_ids(content.read().decode('utf-8', errors='ignore'), first_column=True)
+    return parse_user_ids(message.text or "")
+
 @dp.message(F.text == "🚫 Забанить пользователя")
-async def start_ban(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def start_ban(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
-        "🚫 <b>Введите ID пользователя для бана:</b>\n\n"
-        "Напишите /cancel для отмены.",
+        "🚫 <b>Введите ID пользователя для бана:</b>\n\n" + BAN_LIST_HINT,
         parse_mode=ParseMode.HTML,
         reply_markup=get_cancel_keyboard()
     )
     await state.set_state(AdminState.waiting_for_ban)
 
-@dp.message(AdminState.waiting_for_ban)
-async def process_ban(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+@dp.message(F.text == "✅ Разбанить пользователя")
+async def start_unban(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
+    await message.answer(
+        "✅ <b>Введите ID пользователя для разбана:</b>\n\n" + BAN_LIST_HINT,
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_cancel_keyboard()
+    )
+    await state.set_state(AdminState.waiting_for_unban)
+
+@dp.message(AdminState.waiting_for_ban)
+async def process_ban(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
+        return
+    await process_ban_list(message, state, ban=True)
+
+@dp.message(AdminState.waiting_for_unban)
+async def process_unban(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
+        return
+    await process_ban_list(message, state, ban=False)
+
+async def process_ban_list(message: types.Message, state: FSMContext, ban: bool):
+    """Бан/разбан списка ID одной транзакцией; уведомления уходят через планировщик"""
     if message.text and message.text == "❌ Отмена":
         await state.clear()
         await message.answer("❌ Отменено.", reply_markup=get_ban_unban_keyboard())
         return
     
-    try:
-        user_id = int(message.text.strip())
-    except ValueError:
+    user_ids = await read_user_ids(message)
+    if not user_ids:
         await message.answer(
-            "⚠️ <b>Неверный ID!</b>\n\nВведите числовое ID пользователя.",
+            "⚠️ <b>Неверный ID!</b>\n\nВведите числовые ID пользователей или пришлите файл со списком "
+            f"(не больше {BAN_FILE_MAX_BYTES // 1024 // 1024} МБ).",
             parse_mode=ParseMode.HTML,
             reply_markup=get_cancel_keyboard()
         )
         return
     
-    if user_id == ADMIN_ID:
-        await message.answer("⛔️ Нельзя забанить создателя бота!", reply_markup=get_ban_unban_keyboard())
-        await state.clear()
-        return
+    protected = ban and ADMIN_ID in user_ids
+    if protected:
+        user_ids = [user_id for user_id in user_ids if user_id != ADMIN_ID]
+        if not user_ids:
+            await message.answer("⛔️ Нельзя забанить создателя бота!", reply_markup=get_ban_unban_keyboard())
+            await state.clear()
+            return
     
-    user = db.get_user_by_id(user_id)
+    if ban:
+        changed, skipped, unknown = await db.ban_users(user_ids)
+    else:
+        changed, skipped, unknown = await db.unban_users(user_ids)
     
-    if not user:
+    if len(user_ids) == 1 and unknown:
         await message.answer(
-            f"❌ <b>Пользователь с ID {user_id} не найден!</b>",
+            f"❌ <b>Пользователь с ID {user_ids[0]} не найден!</b>",
             parse_mode=ParseMode.HTML,
             reply_markup=get_cancel_keyboard()
         )
         return
     
-    db.ban_user(user_id)
+    # Уведомляем пользователей в общем темпе отправки, а не пачкой запросов подряд
+    await scheduler.schedule_many(changed, 'ban_notice' if ban else 'unban_notice')
     
-    # Уведомляем пользователя
-    try:
-        await bot.send_message(
-            chat_id=user_id,
-            text="🚫 Вы были заблокированы в этом боте.\nОбратитесь к администрации для разблокировки."
+    if len(user_ids) == 1 and not protected:
+        title = "✅ <b>Пользователь забанен!</b>" if ban else "✅ <b>Пользователь разбанен!</b>"
+        text = f"{title}\n\nID: <code>{user_ids[0]}</code>"
+    else:
+        action = "Забанено" if ban else "Разбанено"
+        text = (
+            f"✅ <b>Список обработан.</b>\n\n"
+            f"{action}: {len(changed)}\n"
+            f"Пропущено ({'уже забанены' if ban else 'не были забанены'}): {skipped}\n"
+            f"Нет в базе: {unknown}"
         )
-    except:
-        pass
-    
-    await message.answer(
-        f"✅ <b>Пользователь забанен!</b>\n\nID: <code>{user_id}</code>",
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_ban_unban_keyboard()
-    )
+        if protected:
+            text += "\n\n⛔️ Создатель бота пропущен."
+        if changed:
+            text += "\n\n<i>Уведомления пользователям отправляются в фоне.</i>"
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=get_ban_unban_keyboard())
     await state.clear()
 
-@dp.message(F.text == "✅ Разбанить пользователя")
-async def start_unban(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
-        return
-    
-    await message.answer(
-        "✅ <b>Введите ID пользователя для разбана:</b>\n\n"
-        "Напишите /cancel для отмены.",
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_cancel_keyboard()
-    )
-    await state.set_state(AdminState.waiting_for_unban)
+def format_banned_page(banned, title: str) -> str:
+    lines = [title, ""]
+    for user_id, username, first_name in banned:
+        line = f"• ID: <code>{user_id}</code> — {html.escape(first_name or 'Без имени')}"
+        if username:
+            line += f" (@{username})"
+        lines.append(line)
+    return "\n".join(lines)
 
-@dp.message(AdminState.waiting_for_unban)
-async def process_unban(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
-        return
+def get_banned_page_keyboard(banned, page: int, has_next: bool):
+    """Листание keyset-страницами: в callback — граничный user_id и номер страницы"""
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"bans:prev:{banned[0][0]}:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"bans:next:{banned[-1][0]}:{page + 1}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(text="🔍 Поиск по ID / username", callback_data="bans:search")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def render_banned_page(page: int, after: int = 0, before: int = None):
+    """Текст и клавиатура одной страницы черного списка; страница читается из БД по запросу"""
+    if before is not None:
+        banned = await db.get_banned_users(before=before, limit=BANNED_PAGE_SIZE)
+        has_next = True
+    else:
+        # Лишняя строка показывает, есть ли следующая страница
+        banned = await db.get_banned_users(after=after, limit=BANNED_PAGE_SIZE + 1)
+        has_next = len(banned) > BANNED_PAGE_SIZE
+        banned = banned[:BANNED_PAGE_SIZE]
+    if not banned:
+        return "✅ <b>Забаненных пользователей нет!</b>", None
     
-    if message.text and message.text == "❌ Отмена":
-        await state.clear()
-        await message.answer("❌ Отменено.", reply_markup=get_ban_unban_keyboard())
+    total = db.count_banned()
+    pages = max(1, -(-total // BANNED_PAGE_SIZE))
+    title = f"🚫 <b>Забаненные пользователи</b> ({total}), стр. {page} из {pages}:"
+    return format_banned_page(banned, title), get_banned_page_keyboard(banned, page, has_next)
+
+@dp.message(F.text == "📋 Список забаненных")
+async def show_banned_list(message: types.Message, access: UserAccess):
+    if not access.is_admin:
         return
     
-    try:
-        user_id = int(message.text.strip())
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Неверный ID!</b>\n\nВведите числовое ID пользователя.",
-            parse_mode=ParseMode.HTML,
-            reply_markup=get_cancel_keyboard()
-        )
+    text, keyboard = await render_banned_page(page=1)
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=keyboard or get_ban_unban_keyboard())
+
+@dp.callback_query(F.data.startswith("bans:"))
+async def banned_list_callback(callback: types.CallbackQuery, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
+        await callback.answer()
         return
     
-    user = db.get_user_by_id(user_id)
-    
-    if not user:
-        await message.answer(
-            f"❌ <b>Пользователь с ID {user_id} не найден!</b>",
+    if callback.data == "bans:search":
+        await state.set_state(AdminState.waiting_for_ban_search)
+        await callback.message.answer(
+            "🔍 <b>Введите ID или начало username:</b>\n\n"
+            "Напишите /cancel для отмены.",
             parse_mode=ParseMode.HTML,
             reply_markup=get_cancel_keyboard()
         )
+        await callback.answer()
         return
     
-    db.unban_user(user_id)
-    
-    # Уведомляем пользователя
-    try:
-        await bot.send_message(
-            chat_id=user_id,
-            text="✅ Вы были разблокированы в этом боте.\nТеперь вы снова можете пользоваться всеми функциями."
-        )
-    except:
-        pass
-    
-    await message.answer(
-        f"✅ <b>Пользователь разбанен!</b>\n\nID: <code>{user_id}</code>",
-        parse_mode=ParseMode.HTML,
-        reply_markup=get_ban_unban_keyboard()
-    )
-    await state.clear()
+    _, direction, boundary, page = callback.data.split(":")
+    if direction == "next":
+        text, keyboard = await render_banned_page(int(page), after=int(boundary))
+    else:
+        text, keyboard = await render_banned_page(int(page), before=int(boundary))
+    await callback.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+    await callback.answer()
 
-@dp.message(F.text == "📋 Список забаненных")
-async def show_banned_list(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+@dp.message(AdminState.waiting_for_ban_search)
+async def process_ban_search(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     
-    banned = db.get_banned_users()
+    query = (message.text or "").strip()
+    if query in ("❌ Отмена", "/cancel"):
+        await state.clear()
+        await message.answer("❌ Отменено.", reply_markup=get_ban_unban_keyboard())
+        return
     
-    if not banned:
+    found = await db.get_banned_users(search=query, limit=BANNED_PAGE_SIZE + 1)
+    await state.clear()
+    if not found:
         await message.answer(
-            "✅ <b>Забаненных пользователей нет!</b>",
+            f"🔍 Среди забаненных ничего не найдено по запросу <code>{html.escape(query)}</code>.",
             parse_mode=ParseMode.HTML,
             reply_markup=get_ban_unban_keyboard()
         )
         return
     
-    text = "🚫 <b>Забаненные пользователи:</b>\n\n"
-    for user in banned:
-        user_id, username, first_name = user
-        text += f"• ID: <code>{user_id}</code> — {first_name or 'Без имени'}"
-        if username:
-            text += f" (@{username})"
-        text += "\n"
-    
+    title = f"🔍 <b>Найдено среди забаненных</b> по запросу <code>{html.escape(query)}</code>:"
+    if len(found) > BANNED_PAGE_SIZE:
+        title += f"\n<i>Показаны первые {BANNED_PAGE_SIZE}, уточните запрос.</i>"
     await message.answer(
-        text,
+        format_banned_page(found[:BANNED_PAGE_SIZE], title),
         parse_mode=ParseMode.HTML,
         reply_markup=get_ban_unban_keyboard()
     )
 
 @dp.message(F.text == "❌ Назад")
-async def back_to_admin(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+async def back_to_admin(message: types.Message, access: UserAccess):
+    if not access.is_admin:
         return
     
     await message.answer(
@@ -421,26 +769,120 @@ async def back_to_admin(message: types.Message):
 # --- 4. СТАТИСТИКА ---
 
 @dp.message(F.text == "📊 Статистика")
-async def show_stats(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
+async def show_stats(message: types.Message, access: UserAccess):
+    if not access.is_admin:
         return
     
-    users = db.get_all_users()
-    banned = db.get_banned_users()
+    stats = await db.get_stats()
+    new_by_day = "\n".join(f"  {day}: +{count}" for day, count in stats['new_by_day']) or "  —"
     
     await message.answer(
         f"📊 <b>Статистика бота</b>\n\n"
-        f"Всего пользователей: {len(users)}\n"
-        f"Забанено: {len(banned)}\n"
-        f"Активных: {len(users) - len(banned)}",
+        f"Всего пользователей: {stats['total']}\n"
+        f"Забанено: {stats['banned']}\n"
+        f"Активных: {stats['total'] - stats['banned']}\n"
+        f"Недоступны (заблокировали бота): {stats['unreachable']}\n\n"
+        f"Писали за 24 ч: {stats['active_day']}\n"
+        f"Писали за 7 дней: {stats['active_week']}\n\n"
+        f"<b>Новые пользователи по дням:</b>\n{new_by_day}\n\n"
+        f"Очередь записи в БД: {db.write_queue_depth()}\n"
+        f"<i>Обновлено {stats['cached_for']:.0f} с назад</i>",
         reply_markup=get_admin_keyboard(),
         parse_mode=ParseMode.HTML
     )
 
+@dp.message(Command("resync_bans"))
+async def resync_bans(message: types.Message, access: UserAccess):
+    if not access.is_admin:
+        return
+    
+    count = await db.reload_banned()
+    await message.answer(
+        f"🔄 <b>Черный список перечитан из базы.</b>\n\nЗабанено: {count}",
+        parse_mode=ParseMode.HTML
+    )
+
+# --- 5. ВЫГРУЗКА ---
+
+export_task: Optional[asyncio.Task] = None
+
+async def run_export(fmt: str, segment: str):
+    """Фоновая выгрузка: файл пишется во временный каталог и отправляется админу документом"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = f"users-{datetime.now():%Y%m%d-%H%M}.{fmt}.gz"
+        path = os.path.join(tmp, filename)
+        try:
+            count = await export.export_users(path, fmt, segment)
+            size = os.path.getsize(path)
+            if size > EXPORT_MAX_BYTES:
+                await bot.send_message(
+                    chat_id=ADMIN_ID,
+                    text=f"❌ Файл выгрузки слишком большой для Telegram: {size // 1024 // 1024} МБ. Сузьте сегмент."
+                )
+                return
+            await bot.send_document(
+                chat_id=ADMIN_ID,
+                document=FSInputFile(path, filename=filename),
+                caption=f"📦 Пользователи: {broadcast.segment_title(segment)} — {count} строк"
+            )
+        except Exception as e:
+            logging.exception(f"Выгрузка пользователей не удалась: {e}")
+            await bot.send_message(chat_id=ADMIN_ID, text=f"❌ Выгрузка прервана ошибкой: {e}")
+
+@dp.message(Command("export"))
+async def export_users_command(message: types.Message, access: UserAccess):
+    """/export [csv|jsonl] [сегмент] — выгрузка пользователей в сжатый файл"""
+    global export_task
+    if not access.is_admin:
+        return
+    
+    args = message.text.split()[1:]
+    fmt = args[0] if args else 'csv'
+    segment = args[1] if len(args) > 1 else 'all'
+    try:
+        if fmt not in export.FORMATS:
+            raise ValueError(fmt)
+        broadcast.segment_filters(segment)
+    except ValueError:
+        await message.answer(
+            "⚠️ <b>Формат:</b> <code>/export [csv|jsonl] [сегмент]</code>\n\n"
+            "Сегменты: all, not_banned, active:N, new:N, joined:ГГГГ-ММ-ДД.\n"
+            "Пример: <code>/export jsonl active:30</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    if export_task and not export_task.done():
+        await message.answer("⏳ Предыдущая выгрузка ещё не закончилась.")
+        return
+    with outbound.lane(outbound.NOTIFY):
+        export_task = asyncio.create_task(run_export(fmt, segment))
+    await message.answer(f"⏳ Выгрузка ({fmt}, {broadcast.segment_title(segment)}) началась, файл придёт сюда.")
+
+# --- 6. РЕЗЕРВНАЯ КОПИЯ ---
+
+@dp.message(Command("backup"))
+async def backup_command(message: types.Message, access: UserAccess):
+    """/backup — внеочередная резервная копия БД"""
+    if not access.is_admin:
+        return
+    
+    await message.answer("⏳ Делаю резервную копию...")
+    try:
+        result = await db_maintenance.run_job('backup')
+    except Exception as e:
+        await message.answer(f"❌ Резервная копия не удалась: {html.escape(str(e))}", parse_mode=ParseMode.HTML)
+        return
+    await message.answer(
+        f"💾 <b>Резервная копия готова:</b> {html.escape(result)}\n"
+        f"Хранится копий: {len(db_maintenance.list_backups())}",
+        parse_mode=ParseMode.HTML
+    )
+
 # --- ОТМЕНА ---
 @dp.message(Command("cancel"))
-async def cancel_handler(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
+async def cancel_handler(message: types.Message, state: FSMContext, access: UserAccess):
+    if not access.is_admin:
         return
     await state.clear()
     await message.answer("❌ Действие отменено.", reply_markup=get_admin_keyboard())
@@ -448,25 +890,25 @@ async def cancel_handler(message: types.Message, state: FSMContext):
 # === ХЕНДЛЕРЫ ПОЛЬЗОВАТЕЛЯ ===
 
 @dp.message(CommandStart())
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, access: UserAccess):
+    # Проверка на бан при старте: забаненного не перезаписываем, иначе /start снимал бы бан
+    if access.is_banned:
+        await message.answer("🚫 Вы заблокированы в этом боте.\nОбратитесь к администрации для разблокировки.")
+        return
+    
     db.add_user(
         message.from_user.id, 
         message.from_user.username, 
         message.from_user.first_name
     )
     
-    if message.from_user.id == ADMIN_ID:
+    if access.is_admin:
         await message.answer(
             "👋 <b>Привет, Создатель!</b>\n\nБот готов к работе. Выберите действие:",
             reply_markup=get_admin_keyboard(),
             parse_mode=ParseMode.HTML
         )
     else:
-        # Проверка на бан при старте
-        if db.is_user_banned(message.from_user.id):
-            await message.answer("🚫 Вы заблокированы в этом боте.\nОбратитесь к администрации для разблокировки.")
-            return
-        
         user_name = message.from_user.first_name or "Пользователь"
         text = (
             f"👋 Привет, {user_name}! Меня зовут Мэри — твой личный ассистент.\n\n"
@@ -475,11 +917,11 @@ async def cmd_start(message: types.Message):
             "Если есть вопросы — я всегда на связи! 👇"
         )
         await message.answer(text, reply_markup=get_user_keyboard(), parse_mode=ParseMode.HTML)
-        asyncio.create_task(send_followup(message.from_user.id))
+        await scheduler.schedule(message.from_user.id, 'followup', FOLLOWUP_DELAY)
 
 @dp.callback_query(F.data == "ask_question")
-async def ask_question_callback(callback: types.CallbackQuery):
-    if db.is_user_banned(callback.from_user.id):
+async def ask_question_callback(callback: types.CallbackQuery, access: UserAccess):
+    if access.is_banned:
         await callback.answer("🚫 Вы заблокированы!", show_alert=True)
         return
     
@@ -489,7 +931,7 @@ async def ask_question_callback(callback: types.CallbackQuery):
     await callback.answer()
 
 @dp.message(F.text)
-async def handle_user_message(message: types.Message, state: FSMContext):
+async def handle_user_message(message: types.Message, state: FSMContext, access: UserAccess):
     """Обработка сообщений от пользователей с проверкой на бан и спам"""
     
     # Игнорируем команды
@@ -497,32 +939,27 @@ async def handle_user_message(message: types.Message, state: FSMContext):
         return
     
     # Игнорируем админа
-    if message.from_user.id == ADMIN_ID:
+    if access.is_admin:
         return
     
     # === ПРОВЕРКА ДОСТУПА ===
-    if not await check_user_access(message):
+    if not await check_user_access(message, access):
         return
 
-    user_name = message.from_user.first_name or "Пользователь"
-    user_username = f"@{message.from_user.username}" if message.from_user.username else "нет username"
-    user_id = message.from_user.id
-
-    await bot.send_message(
-        chat_id=ADMIN_ID,
-        text=f"❓ <b>Вопрос от пользователя</b>\n"
-             f"👤 {user_name} ({user_username})\n"
-             f"🆔 ID: <code>{user_id}</code>\n\n"
-             f"<i>💬 Чтобы ответить — используйте кнопку 'Написать пользователю' выше.</i>",
-        parse_mode=ParseMode.HTML
-    )
-    await message.copy_to(chat_id=ADMIN_ID)
+    # Админу вопрос уйдёт из очереди (вместе с другими — одним дайджестом),
+    # пользователь получает подтверждение сразу
+    admin_notifier.submit(Question(
+        user_id=message.from_user.id,
+        message_id=message.message_id,
+        first_name=message.from_user.first_name,
+        username=message.from_user.username,
+        text=message.text
+    ))
     await message.answer("✅ Ваш вопрос отправлен! Я скоро отвечу.")
 
 # === ВТОРОЕ СООБЩЕНИЕ (FOLLOW-UP) ===
+@scheduler.handler('followup')
 async def send_followup(user_id: int):
-    await asyncio.sleep(FOLLOWUP_DELAY)
-    
     if db.is_user_banned(user_id):
         return
     
@@ -533,15 +970,161 @@ async def send_followup(user_id: int):
     )
     try:
         await bot.send_message(chat_id=user_id, text=text)
+    except TelegramRetryAfter:
+        raise  # планировщик повторит после паузы
     except Exception as e:
         logging.warning(f"Follow-up failed for {user_id}: {e}")
 
-# === ЗАПУСК ===
+@scheduler.handler('ban_notice')
+async def send_ban_notice(user_id: int):
+    if not db.is_user_banned(user_id):
+        return  # успели разбанить
+    await bot.send_message(
+        chat_id=user_id,
+        text="🚫 Вы были заблокированы в этом боте.\nОбратитесь к администрации для разблокировки."
+    )
+
+@scheduler.handler('unban_notice')
+async def send_unban_notice(user_id: int):
+    if db.is_user_banned(user_id):
+        return  # успели забанить снова
+    await bot.send_message(
+        chat_id=user_id,
+        text="✅ Вы были разблокированы в этом боте.\nТеперь вы снова можете пользоваться всеми функциями."
+    )
+
+# === ФОНОВЫЕ ЗАДАЧИ ===
+async def flush_activity():
+    """Периодически передаёт время последних сообщений из лимитера в очередь записи БД"""
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_SECONDS)
+        db.touch_users(spam_limiter.drain_last_seen())
+
+@metrics.on_scrape
+async def update_queue_metrics():
+    metrics.SCHEDULED_PENDING.set(await db.count_scheduled('followup'), kind='followup')
+    metrics.WRITE_QUEUE_DEPTH.set(db.write_queue_depth())
+    for lane, depth in outbound_dispatcher.depth().items():
+        outbound.QUEUE_DEPTH.set(depth, lane=lane)
+
+# === ЗАПУСК И ОСТАНОВКА ===
+# По SIGTERM (docker compose up -d при деплое) бот снимается с /readyz, перестаёт
+# принимать апдейты и за SHUTDOWN_TIMEOUT доделывает начатое: хендлеры, текущие
+# отправки рассылок и отложенных сообщений, вопросы админу. Рассылки не
+# отменяются, а продолжаются после запуска; очередь записи БД сбрасывается.
+
+stop_event = asyncio.Event()
+
+@metrics.readiness_check
+async def database_ready():
+    await db.ping()
+
+def handle_stop_signal(sig: signal.Signals):
+    logging.warning(f"Получен {sig.name}, останавливаемся...")
+    stop_event.set()
+
+async def wait_for(aw, timeout: float, what: str) -> bool:
+    """Ждёт aw не дольше timeout; по истечении пишет в лог, что не успели"""
+    try:
+        await asyncio.wait_for(aw, max(timeout, 0.1))
+        return True
+    except asyncio.TimeoutError:
+        logging.warning(f"Остановка: не дождались — {what}")
+        return False
+
+async def shutdown(server: Optional[WebhookServer], background: Dict[str, asyncio.Task]):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+
+    def remaining() -> float:
+        return deadline - loop.time()
+
+    metrics.set_ready(False)
+    # 1. Новые апдейты больше не берём
+    if server is not None:
+        await server.stop(unregister=bool(WEBHOOK_URL), drain_timeout=remaining())
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    else:
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            pass  # polling уже завершился
+    # 2. Производители новых отправок останавливаются, начатое досылается
+    scheduler.stop()
+    for control in active_broadcasts.values():
+        control.stop()
+    if export_task and not export_task.done():
+        export_task.cancel()
+    pending = [inflight.wait_idle(), *broadcast_tasks, background['scheduler']]
+    await wait_for(asyncio.gather(*pending, return_exceptions=True), remaining(),
+                   f"хендлеров {inflight.count}, рассылок {len(broadcast_tasks)}")
+    # Вопросы, принятые хендлерами, досылаем сами: цикл уведомлений останавливаем
+    # (недосланный дайджест остаётся в нём и уходит в flush)
+    background['notifier'].cancel()
+    await asyncio.gather(background['notifier'], return_exceptions=True)
+    await wait_for(admin_notifier.flush(), remaining(),
+                   f"вопросов админу в очереди {admin_notifier.queue.qsize()}")
+    # 3. Что не успело — отменяем; рассылки при отмене сохраняют итоги отправленного
+    tasks = [*background.values(), *broadcast_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.session.close()
+    db.touch_users(spam_limiter.drain_last_seen())
+    await db.close_db(timeout=remaining())
+    logging.info("Бот остановлен.")
+
 async def main():
-    db.init_db()
+    if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook требует WEBHOOK_SECRET: без него любой может прислать боту поддельный апдейт")
+    stop_event.clear()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, handle_stop_signal, sig)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows или не главный поток
+    # Метрики и /healthz доступны сразу, /readyz — после прогрева
+    metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    await db.init_db()
     logging.info("База данных инициализирована.")
+    if DB_INCREMENTAL_VACUUM and not await db.enable_incremental_vacuum():
+        logging.info("БД уже в режиме auto_vacuum=INCREMENTAL, DB_INCREMENTAL_VACUUM можно убрать.")
+    expired = await fsm_storage.purge_expired()
+    if expired:
+        logging.info(f"Удалено брошенных состояний FSM: {expired}")
     logging.info(f"Бот запущен. Ожидание подключений...")
-    await dp.start_polling(bot)
+    background = {
+        'scheduler': asyncio.create_task(scheduler.run()),
+        'activity': asyncio.create_task(flush_activity()),
+        'notifier': asyncio.create_task(admin_notifier.run()),
+        'maintenance': asyncio.create_task(db_maintenance.run()),
+    }
+    resumed = [start_broadcast_task(job) for job in await db.get_unfinished_broadcasts()]
+    if resumed:
+        logging.info(f"Возобновлено рассылок: {len(resumed)}")
+    server = None
+    try:
+        if BOT_MODE == 'webhook':
+            server = WebhookServer(dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET, workers=WEBHOOK_WORKERS)
+            await dp.emit_startup(bot=bot, dispatcher=dp)
+            await server.start(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL)
+        stopping = asyncio.create_task(stop_event.wait())
+        receiving = stopping
+        if server is None:
+            # Сигналы и закрытие сессии — на нашей стороне: после остановки polling ещё досылаем начатое
+            receiving = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+        metrics.set_ready(True)
+        await asyncio.wait({receiving, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if receiving.done() and not stop_event.is_set():
+            receiving.result()  # polling упал — пробрасываем ошибку после остановки
+    finally:
+        try:
+            await shutdown(server, background)
+        finally:
+            if metrics_runner:
+                await metrics_runner.cleanup()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,166 @@
+import asyncio
+import glob
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List
+
+import database as db
+import metrics
+
+# === ОБСЛУЖИВАНИЕ БАЗЫ ===
+# Периодические задачи над users.db: резервные копии с хранением последних
+# BACKUP_KEEP штук, checkpoint WAL, ANALYZE, incremental vacuum и удаление
+# устаревших служебных записей (сообщения с вопросами, получатели законченных
+# рассылок). Один цикл запускает задачи по их интервалам, время и ошибки каждой
+# задачи пишутся в метрики. В контейнере BACKUP_DIR должен лежать на
+# примонтированном томе, иначе копии пропадут при передеплое.
+
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL = 6 * 3600      # сек между резервными копиями
+BACKUP_KEEP = 7                 # сколько последних копий хранить
+CHECKPOINT_INTERVAL = 300       # сек между checkpoint WAL
+ANALYZE_INTERVAL = 24 * 3600
+VACUUM_INTERVAL = 24 * 3600
+VACUUM_PAGES = 2000             # страниц за один incremental vacuum (0 — все)
+RETENTION_INTERVAL = 24 * 3600
+ADMIN_MESSAGES_TTL = 30 * 86400  # сколько помнить сообщения с вопросами для ответа реплаем
+BROADCAST_RECIPIENTS_TTL = 7 * 86400  # сколько хранить получателей законченной рассылки
+
+JOB_DURATION = metrics.Histogram(
+    'bot_maintenance_duration_seconds', 'Время задач обслуживания БД', ['job'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+JOB_ERRORS = metrics.Counter('bot_maintenance_errors_total', 'Ошибки задач обслуживания БД', ['job'])
+JOB_LAST_SUCCESS = metrics.Gauge('bot_maintenance_last_success_timestamp', 'Когда задача последний раз прошла успешно', ['job'])
+BACKUP_SIZE = metrics.Gauge('bot_backup_size_bytes', 'Размер последней резервной копии')
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    func: Callable[[], Awaitable[str]]
+    next_run: float = 0.0
+
+class Maintenance:
+    def __init__(
+        self,
+        backup_dir: str = BACKUP_DIR,
+        backup_keep: int = BACKUP_KEEP,
+        backup_interval: float = BACKUP_INTERVAL,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        analyze_interval: float = ANALYZE_INTERVAL,
+        vacuum_interval: float = VACUUM_INTERVAL,
+        retention_interval: float = RETENTION_INTERVAL,
+        admin_messages_ttl: float = ADMIN_MESSAGES_TTL,
+        broadcast_recipients_ttl: float = BROADCAST_RECIPIENTS_TTL,
+    ):
+        self.backup_dir = backup_dir
+        self.backup_keep = backup_keep
+        self.admin_messages_ttl = admin_messages_ttl
+        self.broadcast_recipients_ttl = broadcast_recipients_ttl
+        self._lock = asyncio.Lock()
+        now = time.time()
+        # Интервал 0 выключает задачу; первая копия — сразу после старта
+        jobs = [
+            Job('backup', backup_interval, self.backup, now),
+            Job('checkpoint', checkpoint_interval, self.checkpoint, now + checkpoint_interval),
+            Job('analyze', analyze_interval, self.analyze, now + 60),
+            Job('vacuum', vacuum_interval, self.vacuum, now + vacuum_interval),
+            Job('retention', retention_interval, self.retention, now + 120),
+        ]
+        self.jobs: Dict[str, Job] = {job.name: job for job in jobs if job.interval > 0}
+
+    # === ЗАДАЧИ ===
+
+    async def backup(self) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"users-{datetime.now():%Y%m%d-%H%M%S}.db"
+        path = os.path.join(self.backup_dir, name)
+        # Пишем во временный файл: недописанная копия не попадёт в список готовых
+        size = await db.backup(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        BACKUP_SIZE.set(size)
+        removed = self._prune_backups()
+        return f"{name}, {size // 1024} КБ, удалено старых: {removed}"
+
+    def _prune_backups(self) -> int:
+        backups = sorted(glob.glob(os.path.join(self.backup_dir, 'users-*.db')))
+        stale = backups[:-self.backup_keep] if self.backup_keep > 0 else []
+        for path in stale:
+            os.remove(path)
+        return len(stale)
+
+    def list_backups(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.backup_dir, 'users-*.db')))
+
+    async def checkpoint(self) -> str:
+        busy, wal_pages, moved = await db.checkpoint('PASSIVE')
+        return f"WAL: {wal_pages} стр., перенесено {moved}" + (", БД занята" if busy else "")
+
+    async def analyze(self) -> str:
+        await db.analyze()
+        return "статистика обновлена"
+
+    async def vacuum(self) -> str:
+        if await db.get_auto_vacuum() != 2:
+            # Без auto_vacuum=INCREMENTAL прагма ничего не делает; перевод — DB_INCREMENTAL_VACUUM=1
+            return "пропущено: БД не в режиме auto_vacuum=INCREMENTAL"
+        freed = await db.incremental_vacuum(VACUUM_PAGES)
+        # После вакуума WAL разрастается — сразу переносим и обрезаем его
+        await db.checkpoint('TRUNCATE')
+        return f"освобождено страниц: {freed}"
+
+    async def retention(self) -> str:
+        deleted = await db.delete_admin_messages(time.time() - self.admin_messages_ttl)
+        finished_before = datetime.now(timezone.utc) - timedelta(seconds=self.broadcast_recipients_ttl)
+        recipients = await db.delete_finished_recipients(finished_before.strftime('%Y-%m-%d %H:%M:%S'))
+        return f"удалено старых сообщений с вопросами: {deleted}, получателей законченных рассылок: {recipients}"
+
+    # === ЦИКЛ ===
+
+    async def run_job(self, name: str) -> str:
+        """Выполняет задачу сейчас (задачи не пересекаются), возвращает краткий итог"""
+        job = self.jobs.get(name) or Job(name, 0, getattr(self, name))
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                result = await job.func()
+            except Exception:
+                JOB_ERRORS.inc(job=name)
+                raise
+            finally:
+                JOB_DURATION.observe(time.perf_counter() - started, job=name)
+        JOB_LAST_SUCCESS.set(time.time(), job=name)
+        logging.info(f"Обслуживание БД: {name} за {time.perf_counter() - started:.2f} с — {result}")
+        return result
+
+    async def run(self):
+        while True:
+            job = min(self.jobs.values(), key=lambda job: job.next_run, default=None)
+            if job is None:
+                return
+            await asyncio.sleep(max(0.0, job.next_run - time.time()))
+            job.next_run = time.time() + job.interval
+            try:
+                await self.run_job(job.name)
+            except Exception as e:
+                logging.exception(f"Задача обслуживания БД {job.name} не удалась: {e}")
+
+def from_env() -> Maintenance:
+    """Настройки из окружения: интервалы в секундах, 0 — выключить задачу"""
+    def number(name: str, default: float) -> float:
+        return float(os.getenv(name, default))
+    return Maintenance(
+        backup_dir=os.getenv('BACKUP_DIR', BACKUP_DIR),
+        backup_keep=int(number('BACKUP_KEEP', BACKUP_KEEP)),
+        backup_interval=number('BACKUP_INTERVAL', BACKUP_INTERVAL),
+        checkpoint_interval=number('CHECKPOINT_INTERVAL', CHECKPOINT_INTERVAL),
+        analyze_interval=number('ANALYZE_INTERVAL', ANALYZE_INTERVAL),
+        vacuum_interval=number('VACUUM_INTERVAL', VACUUM_INTERVAL),
+        retention_interval=number('RETENTION_INTERVAL', RETENTION_INTERVAL),
+        admin_messages_ttl=number('ADMIN_MESSAGES_TTL', ADMIN_MESSAGES_TTL),
+        broadcast_recipients_ttl=number('BROADCAST_RECIPIENTS_TTL', BROADCAST_RECIPIENTS_TTL),
+    )
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+# === МЕТРИКИ В ФОРМАТЕ PROMETHEUS ===
+# Минимальная реализация без внешних зависимостей: счётчики, gauge и гистограммы
+# с метками. Запись — пара операций над словарём, поэтому метрики можно держать
+# включёнными в проде. Отдаются по HTTP на /metrics, там же /healthz и /readyz.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+_registry: List['Metric'] = []
+_scrape_hooks: List[Callable[[], Awaitable[None]]] = []
+_readiness_checks: List[Callable[[], Awaitable[None]]] = []
+_ready = False
+READY_CHECK_TIMEOUT = 2.0  # сек на каждую проверку готовности
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Строки значений в текстовом формате Prometheus"""
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in self._values.items()]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._label_values(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._label_values(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор для корутин: пишет длительность вызова в гистограмму"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+def on_scrape(hook: Callable[[], Awaitable[None]]):
+    """Регистрирует корутину, обновляющую gauge прямо перед выдачей метрик"""
+    _scrape_hooks.append(hook)
+    return hook
+
+async def render() -> str:
+    for hook in _scrape_hooks:
+        await hook()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# === ЗДОРОВЬЕ ===
+# /healthz — процесс жив и event loop отвечает (liveness). /readyz — бот прогрет
+# и принимает апдейты: флаг выставляет main после старта и снимает при остановке,
+# плюс зарегистрированные проверки (например, что БД отвечает).
+
+def set_ready(ready: bool):
+    global _ready
+    _ready = ready
+
+def readiness_check(check: Callable[[], Awaitable[None]]):
+    """Регистрирует корутину для /readyz: исключение или таймаут — бот не готов"""
+    _readiness_checks.append(check)
+    return check
+
+async def healthz_handler(request: web.Request) -> web.Response:
+    return web.Response(text='ok')
+
+async def readyz_handler(request: web.Request) -> web.Response:
+    if not _ready:
+        return web.Response(status=503, text='not ready')
+    for check in _readiness_checks:
+        try:
+            await asyncio.wait_for(check(), READY_CHECK_TIMEOUT)
+        except Exception as e:
+            return web.Response(status=503, text=f'{check.__name__}: {type(e).__name__} {e}')
+    return web.Response(text='ready')
+
+# === HTTP ===
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=await render(), content_type='text/plain', charset='utf-8')
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/healthz', healthz_handler)
+    app.router.add_get('/readyz', readyz_handler)
+    return app
+
+async def start_server(host: str, port: int, app: Optional[web.Application] = None) -> web.AppRunner:
+    runner = web.AppRunner(app or create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+# === МЕТРИКИ БОТА ===
+
+HANDLER_DURATION = Histogram('bot_handler_duration_seconds', 'Время работы хендлера', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения в хендлерах', ['handler', 'error'])
+DB_DURATION = Histogram('bot_db_call_duration_seconds', 'Время вызова функций database.py', ['function'])
+DB_QUERIES = Counter('bot_db_queries_total', 'Обращений к SQLite (round trip в поток БД)', ['kind'])
+API_DURATION = Histogram('bot_api_request_duration_seconds', 'Время запроса к Bot API', ['method'])
+API_REQUESTS = Counter('bot_api_requests_total', 'Запросы к Bot API по методу и результату', ['method', 'result'])
+BROADCAST_MESSAGES = Counter('bot_broadcast_messages_total', 'Сообщения рассылок по результату', ['result'])
+SCHEDULED_PENDING = Gauge('bot_scheduled_messages_pending', 'Отложенные сообщения в очереди', ['kind'])
+WRITE_QUEUE_DEPTH = Gauge('bot_db_write_queue_depth', 'Строк в очереди отложенной записи')
+# Длительность сброса — в bot_db_call_duration_seconds{function="flush_writes"}
+WRITE_FLUSHES = Counter('bot_db_write_flushes_total', 'Сбросы отложенной записи по результату', ['result'])
+WRITE_FLUSHED_ROWS = Counter('bot_db_write_flushed_rows_total', 'Строк записано отложенной записью')
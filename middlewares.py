@@ -0,0 +1,144 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.bases import CancelHandler, SkipHandler
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, TelegramObject
+
+import database as db
+import metrics
+from ratelimit import RateLimiter
+
+# === ПРОВЕРКА ДОСТУПА ===
+# Внешний middleware один раз на апдейт определяет, кто пишет: админ ли это,
+# забанен ли и не превышен ли лимит сообщений — всё в памяти, без запросов к БД.
+# Результат передаётся хендлерам аргументом access.
+
+@dataclass
+class UserAccess:
+    user_id: int
+    is_admin: bool = False
+    is_banned: bool = False
+    is_spam: bool = False
+
+def is_user_question(event: TelegramObject) -> bool:
+    """Текстовое сообщение, которое пойдёт админу как вопрос (команды не считаются)"""
+    return isinstance(event, Message) and bool(event.text) and not event.text.startswith('/')
+
+class AccessMiddleware(BaseMiddleware):
+    def __init__(self, admin_id: int, limiter: RateLimiter):
+        self.admin_id = admin_id
+        self.limiter = limiter
+
+    async def resolve(self, user_id: int, event: TelegramObject) -> UserAccess:
+        if user_id == self.admin_id:
+            return UserAccess(user_id, is_admin=True)
+        access = UserAccess(user_id, is_banned=db.is_user_banned(user_id))
+        if not access.is_banned and is_user_question(event):
+            access.is_spam = self.limiter.hit(user_id)
+        return access
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            data['access'] = await self.resolve(user.id, event)
+        return await handler(event, data)
+
+
+# === МЕТРИКИ ===
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и исключения каждого хендлера по его имени"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except (SkipHandler, CancelHandler):
+            raise  # управление потоком aiogram, а не ошибка хендлера
+        except Exception as e:
+            metrics.HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.HANDLER_DURATION.observe(time.perf_counter() - started, handler=name)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и результат каждого запроса к Bot API"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = method.__api_method__
+        started = time.perf_counter()
+        result = 'ok'
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            metrics.API_DURATION.observe(time.perf_counter() - started, method=name)
+            metrics.API_REQUESTS.inc(method=name, result=result)
+
+# === ДОСТУПНОСТЬ ПОЛЬЗОВАТЕЛЕЙ ===
+
+class ReachabilityMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: 403 на отправку в личный чат значит, что пользователь
+    заблокировал бота или удалил аккаунт. Такой пользователь помечается
+    недоступным, и рассылки его пропускают, пока он снова не напишет боту.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        try:
+            return await make_request(bot, method)
+        except TelegramForbiddenError:
+            chat_id = getattr(method, 'chat_id', None)
+            if isinstance(chat_id, int) and chat_id > 0:
+                db.mark_unreachable(chat_id)
+            raise
+
+# === ОБРАБАТЫВАЕМЫЕ АПДЕЙТЫ ===
+
+class InFlightMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: считает апдейты, которые сейчас в хендлерах,
+    чтобы при остановке бота дождаться их, а не оборвать на середине.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def wait_idle(self):
+        await self._idle.wait()
@@ -0,0 +1,168 @@
+import asyncio
+import html
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
+
+import database as db
+import outbound
+
+# === УВЕДОМЛЕНИЯ АДМИНУ О ВОПРОСАХ ===
+# Пользователь получает подтверждение сразу, а вопрос встаёт в очередь. Вопросы,
+# пришедшие за короткое окно, уходят админу одним сообщением-дайджестом в полосе
+# outbound.NOTIFY — темп в чат админа держит диспетчер исходящих, и всплеск
+# вопросов не превращается в поток TelegramRetryAfter. Для каждого
+# отправленного сообщения запоминается, чьи в нём вопросы, — админ отвечает реплаем.
+
+DIGEST_WINDOW = 1.0     # сколько секунд собирать вопросы в один дайджест
+DIGEST_MAX = 20         # вопросов в одном дайджесте
+MESSAGE_LIMIT = 4096    # максимальная длина сообщения Telegram
+
+REPLY_HINT = "<i>💬 Чтобы ответить — ответьте на это сообщение (reply).</i>"
+DIGEST_REPLY_HINT = "<i>💬 Чтобы ответить — ответьте на это сообщение, начав текст с ID пользователя.</i>"
+
+@dataclass
+class Question:
+    user_id: int
+    message_id: int
+    first_name: Optional[str]
+    username: Optional[str]
+    text: str
+
+    def author(self) -> str:
+        name = html.escape(self.first_name or "Пользователь")
+        username = f"@{self.username}" if self.username else "нет username"
+        return f"👤 {name} ({username})\n🆔 ID: <code>{self.user_id}</code>"
+
+def format_question(question: Question) -> str:
+    return (
+        f"❓ <b>Вопрос от пользователя</b>\n"
+        f"{question.author()}\n\n"
+        f"{html.escape(question.text)}\n\n"
+        f"{REPLY_HINT}"
+    )
+
+def format_digest(questions: List[Question]) -> List[Tuple[str, List[Question]]]:
+    """Собирает вопросы в дайджесты не длиннее лимита Telegram: [(текст, вопросы в нём)]"""
+    digests, entries, included = [], [], []
+
+    def close():
+        title = f"❓ <b>Новые вопросы: {len(entries)}</b>"
+        digests.append(("\n\n".join([title, *entries, DIGEST_REPLY_HINT]), included))
+
+    size = 0
+    reserve = len(DIGEST_REPLY_HINT) + 100  # заголовок и подсказка
+    for question in questions:
+        entry = f"{question.author()}\n{html.escape(question.text)}"
+        if entries and size + len(entry) + 2 > MESSAGE_LIMIT - reserve:
+            close()
+            entries, included, size = [], [], 0
+        entries.append(entry)
+        included.append(question)
+        size += len(entry) + 2
+    if entries:
+        close()
+    return digests
+
+class AdminNotifier:
+    def __init__(
+        self,
+        bot: Bot,
+        admin_id: int,
+        window: float = DIGEST_WINDOW,
+        max_batch: int = DIGEST_MAX,
+    ):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._batch: List[Question] = []  # собираемый или отправляемый сейчас дайджест
+
+    def submit(self, question: Question):
+        """Ставит вопрос в очередь, не дожидаясь отправки"""
+        self.queue.put_nowait(question)
+
+    async def _collect(self):
+        """Ждёт первый вопрос и добирает в self._batch остальные, пришедшие за окно"""
+        self._batch.append(await self.queue.get())
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(self._batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    def _drain(self) -> List[Question]:
+        batch = []
+        while not self.queue.empty() and len(batch) < self.max_batch:
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _call(self, method, **kwargs):
+        """Вызов Bot API; при flood control повторяет после паузы диспетчера исходящих"""
+        while True:
+            try:
+                return await method(**kwargs)
+            except TelegramRetryAfter as e:
+                logging.warning(f"Уведомления админу: flood control, пауза {e.retry_after} с")
+
+    async def _send(self, batch: List[Question]):
+        sent: List[Tuple[int, int]] = []  # (message_id в чате админа, user_id)
+        try:
+            short = [q for q in batch if len(format_question(q)) <= MESSAGE_LIMIT]
+            if len(short) == 1:
+                message = await self._call(
+                    self.bot.send_message, chat_id=self.admin_id,
+                    text=format_question(short[0]), parse_mode=ParseMode.HTML,
+                )
+                sent.append((message.message_id, short[0].user_id))
+            elif short:
+                for text, questions in format_digest(short):
+                    message = await self._call(
+                        self.bot.send_message, chat_id=self.admin_id, text=text, parse_mode=ParseMode.HTML
+                    )
+                    sent.extend((message.message_id, q.user_id) for q in questions)
+            # Слишком длинные вопросы не помещаются в текст: заголовок и копия оригинала, как раньше
+            for question in batch:
+                if question in short:
+                    continue
+                header = await self._call(
+                    self.bot.send_message, chat_id=self.admin_id,
+                    text=f"❓ <b>Вопрос от пользователя</b>\n{question.author()}\n\n{REPLY_HINT}",
+                    parse_mode=ParseMode.HTML,
+                )
+                copy = await self._call(
+                    self.bot.copy_message, chat_id=self.admin_id,
+                    from_chat_id=question.user_id, message_id=question.message_id,
+                )
+                sent.extend([(header.message_id, question.user_id), (copy.message_id, question.user_id)])
+        finally:
+            await db.save_admin_messages(sent)
+
+    async def run(self):
+        with outbound.lane(outbound.NOTIFY):
+            while True:
+                await self._collect()
+                try:
+                    await self._send(self._batch)
+                except Exception as e:
+                    logging.warning(f"Не удалось переслать админу вопросов: {len(self._batch)}: {e}")
+                self._batch = []
+
+    async def flush(self):
+        """Отправляет недосланный дайджест и оставшиеся в очереди вопросы (при остановке бота)"""
+        with outbound.lane(outbound.NOTIFY):
+            while self._batch or not self.queue.empty():
+                batch, self._batch = self._batch or self._drain(), []
+                try:
+                    await self._send(batch)
+                except Exception as e:
+                    logging.warning(f"Не удалось переслать админу вопросов: {len(batch)}: {e}")
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+import metrics
+
+# === ИСХОДЯЩИЕ СООБЩЕНИЯ ===
+# Все отправки бота проходят через один диспетчер в middleware сессии: он держит
+# общий темп бота и темп на каждый чат и выдаёт слоты по приоритету полос.
+# Ответы пользователям и админу идут первыми, затем уведомления, затем массовые
+# рассылки — идущая рассылка не задерживает интерактивные ответы больше чем на
+# один слот. Полоса берётся из контекста: lane('bulk') в рассылке наследуют все
+# её задачи. TelegramRetryAfter ставит на паузу весь диспетчер.
+
+INTERACTIVE = 'interactive'  # ответы на апдейты: подтверждения пользователям, ответы админа
+NOTIFY = 'notify'            # уведомления: вопросы админу, отложенные сообщения, прогресс
+BULK = 'bulk'                # рассылки
+LANES = (INTERACTIVE, NOTIFY, BULK)  # по убыванию приоритета
+
+GLOBAL_RATE = 25         # сообщений в секунду на бота, с запасом до лимита Telegram (~30)
+GLOBAL_BURST = 5         # сколько слотов можно выдать разом после простоя или долгой итерации loop
+CHAT_RATE = 1.0          # сообщений в секунду в один чат
+CHAT_BURST = 3           # сколько сообщений в чат можно отправить подряд без ожидания
+MAX_CHATS = 10_000       # после скольких чатов забывать тех, у кого темп восстановился
+# Методы, на которые действуют лимиты Telegram; остальные (getUpdates, answerCallbackQuery...) не ждут
+THROTTLED_PREFIXES = ('send', 'copy', 'forward', 'edit')
+
+WAIT_TIME = metrics.Histogram(
+    'bot_outbound_wait_seconds', 'Ожидание слота на отправку', ['lane'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+QUEUE_DEPTH = metrics.Gauge('bot_outbound_queue_depth', 'Запросов, ждущих слота на отправку', ['lane'])
+
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar('outbound_lane', default=INTERACTIVE)
+
+@contextmanager
+def lane(name: str):
+    """Отправки внутри блока (и в задачах, созданных в нём) идут в полосу name"""
+    if name not in LANES:
+        raise ValueError(f"Неизвестная полоса отправки: {name!r}, доступны: {', '.join(LANES)}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+ChatId = Union[int, str, None]
+
+@dataclass
+class _Request:
+    chat_id: ChatId
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+class Outbound:
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        burst: int = GLOBAL_BURST,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: int = CHAT_BURST,
+        max_chats: int = MAX_CHATS,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._lanes: Dict[str, Deque[_Request]] = {name: deque() for name in LANES}
+        self._chats: Dict[ChatId, List[float]] = {}  # chat_id -> [токены, время пополнения]
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def acquire(self, chat_id: ChatId = None, lane_name: Optional[str] = None):
+        """Ждёт слота на отправку в chat_id; полоса по умолчанию — из контекста"""
+        lane_name = lane_name or _lane.get()
+        request = _Request(chat_id, asyncio.get_running_loop().create_future())
+        self._lanes[lane_name].append(request)
+        self._wakeup.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        try:
+            await request.future
+        finally:
+            WAIT_TIME.observe(time.monotonic() - request.queued_at, lane=lane_name)
+
+    def pause(self, seconds: float):
+        """Останавливает все отправки на seconds (после TelegramRetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def depth(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in self._lanes.items()}
+
+    # === ВЫДАЧА СЛОТОВ ===
+
+    def _chat_ready_at(self, chat_id: ChatId, now: float) -> float:
+        bucket = self._chats.get(chat_id)
+        if chat_id is None or bucket is None:
+            return now
+        tokens = min(self.chat_burst, bucket[0] + (now - bucket[1]) * self.chat_rate)
+        return now if tokens >= 1 else now + (1 - tokens) / self.chat_rate
+
+    def _take_chat_slot(self, chat_id: ChatId, now: float):
+        if chat_id is None:
+            return
+        bucket = self._chats.setdefault(chat_id, [float(self.chat_burst), now])
+        bucket[0] = min(self.chat_burst, bucket[0] + (now - bucket[1]) * self.chat_rate) - 1
+        bucket[1] = now
+        if len(self._chats) > self.max_chats:
+            # Полная корзина ничем не отличается от новой — такие чаты можно забыть
+            refill = self.chat_burst / self.chat_rate
+            self._chats = {key: b for key, b in self._chats.items() if now - b[1] < refill}
+
+    def _pick(self, now: float) -> Tuple[Optional[_Request], float]:
+        """Первый запрос самой приоритетной полосы, чей чат готов; иначе — когда освободится ближайший"""
+        ready_at = float('inf')
+        for queue in self._lanes.values():
+            for request in list(queue):
+                if request.future.done():  # ожидающий отменён
+                    queue.remove(request)
+                    continue
+                chat_ready = self._chat_ready_at(request.chat_id, now)
+                if chat_ready <= now:
+                    queue.remove(request)
+                    return request, now
+                ready_at = min(ready_at, chat_ready)
+        return None, ready_at
+
+    async def _run(self):
+        while any(self._lanes.values()):
+            now = time.monotonic()
+            slot = max(self._next_slot, self._paused_until)
+            if slot > now:
+                await asyncio.sleep(slot - now)
+                continue
+            request, ready_at = self._pick(now)
+            if request is None:
+                if ready_at == float('inf'):
+                    continue  # все ожидающие отменены
+                # Новый запрос в свободный чат будит раньше
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ready_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._take_chat_slot(request.chat_id, now)
+            # Слоты, пропущенные пока loop был занят, выдаются подряд (не больше burst),
+            # иначе под нагрузкой темп упирается в одну выдачу за итерацию loop
+            self._next_slot = max(self._next_slot, now - self.burst / self.rate) + 1 / self.rate
+            request.future.set_result(None)
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: отправки ждут слота в Outbound, flood control ставит его на паузу"""
+
+    def __init__(self, outbound: Outbound):
+        self.outbound = outbound
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if not method.__api_method__.startswith(THROTTLED_PREFIXES):
+            return await make_request(bot, method)
+        await self.outbound.acquire(getattr(method, 'chat_id', None))
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.outbound.pause(e.retry_after)
+            raise
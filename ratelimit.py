@@ -0,0 +1,129 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Tuple
+
+# === ОГРАНИЧЕНИЕ ЧАСТОТЫ СООБЩЕНИЙ ===
+# Лимитеры живут в памяти процесса: проверка — несколько операций над словарём,
+# без обращений к БД. Записи неактивных пользователей вытесняются, поэтому
+# память ограничена max_entries независимо от размера аудитории.
+
+class RateLimiter(ABC):
+    """Общий интерфейс лимитеров: hit() регистрирует сообщение и говорит, превышен ли лимит"""
+
+    def __init__(self, max_entries: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: 'OrderedDict[int, object]' = OrderedDict()
+        self._last_seen: Dict[int, float] = {}
+
+    def hit(self, key: int) -> bool:
+        """Возвращает True, если лимит превышен (спам), False если сообщение пропущено"""
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._new_entry(now)
+            self._entries[key] = entry
+        else:
+            self._entries.move_to_end(key)
+        self._evict(now)
+
+        if not self._allow(entry, now):
+            return True
+
+        self._last_seen[key] = time.time()
+        return False
+
+    def drain_last_seen(self) -> List[Tuple[int, str]]:
+        """Забирает накопленные времена последних сообщений для записи в БД"""
+        last_seen, self._last_seen = self._last_seen, {}
+        return [
+            (user_id, datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+            for user_id, ts in last_seen.items()
+        ]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        # Записи упорядочены по последнему обращению: с начала лежат самые старые,
+        # текущая запись всегда в конце и не вытесняется
+        while len(self._entries) > 1:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and not self._is_idle(entry, now):
+                break
+            del self._entries[key]
+
+    @abstractmethod
+    def _new_entry(self, now: float) -> object:
+        """Состояние нового пользователя"""
+
+    @abstractmethod
+    def _allow(self, entry: object, now: float) -> bool:
+        """Пропустить ли сообщение; при пропуске учитывает его в entry"""
+
+    @abstractmethod
+    def _is_idle(self, entry: object, now: float) -> bool:
+        """Запись не отличается от новой и её можно вытеснить"""
+
+
+class SlidingWindowLimiter(RateLimiter):
+    """Не больше burst сообщений за последние window секунд"""
+
+    def __init__(self, window: float, burst: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.window = window
+        self.burst = burst
+
+    def _new_entry(self, now: float) -> Deque[float]:
+        return deque(maxlen=self.burst)
+
+    def _allow(self, hits: Deque[float], now: float) -> bool:
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+        if len(hits) >= self.burst:
+            return False
+        hits.append(now)
+        return True
+
+    def _is_idle(self, hits: Deque[float], now: float) -> bool:
+        return not hits or now - hits[-1] >= self.window
+
+
+class TokenBucketLimiter(RateLimiter):
+    """Корзина на burst токенов, пополняется на burst токенов за window секунд"""
+
+    def __init__(self, window: float, burst: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.burst = burst
+        self.rate = burst / window
+
+    def _new_entry(self, now: float) -> List[float]:
+        return [float(self.burst), now]  # [токены, время последнего пополнения]
+
+    def _allow(self, bucket: List[float], now: float) -> bool:
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _is_idle(self, bucket: List[float], now: float) -> bool:
+        # Корзина снова полная — запись ничем не отличается от новой
+        return bucket[0] + (now - bucket[1]) * self.rate >= self.burst
+
+
+LIMITERS = {
+    'window': SlidingWindowLimiter,
+    'bucket': TokenBucketLimiter,
+}
+
+def create_limiter(kind: str, window: float, burst: int = 1, max_entries: int = 100_000) -> RateLimiter:
+    try:
+        limiter_cls = LIMITERS[kind]
+    except KeyError:
+        raise ValueError(f"Неизвестный тип лимитера: {kind!r}, доступны: {', '.join(LIMITERS)}")
+    return limiter_cls(window=window, burst=burst, max_entries=max_entries)
+
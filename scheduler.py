@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import database as db
+import outbound
+
+# === ПЛАНИРОВЩИК ОТЛОЖЕННЫХ СООБЩЕНИЙ ===
+# Один цикл вместо отдельной спящей задачи на каждого пользователя. Очередь хранится
+# в таблице scheduled_messages и переживает перезапуск; цикл спит до ближайшего
+# due_at (или до появления более раннего сообщения) и забирает наступившие пачкой.
+# Сообщения уходят в полосе outbound.NOTIFY, темп держит диспетчер исходящих.
+
+DUE_BATCH = 100  # сообщений за одну выборку
+
+MessageHandler = Callable[[int], Awaitable[None]]
+
+class Scheduler:
+    def __init__(self, batch_size: int = DUE_BATCH):
+        self.batch_size = batch_size
+        self.handlers: Dict[str, MessageHandler] = {}
+        self._next_due: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def handler(self, kind: str):
+        """Регистрирует функцию отправки для вида сообщений: @scheduler.handler('followup')"""
+        def decorator(func: MessageHandler) -> MessageHandler:
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    async def schedule(self, user_id: int, kind: str, delay: float) -> bool:
+        """Планирует сообщение через delay секунд; повторный вызов до отправки ничего не меняет"""
+        if kind not in self.handlers:
+            raise ValueError(f"Нет обработчика для отложенных сообщений {kind!r}")
+        due_at = time.time() + delay
+        added = await db.schedule_message(user_id, kind, due_at)
+        if added and (self._next_due is None or due_at < self._next_due):
+            self._wakeup.set()
+        return added
+
+    async def schedule_many(self, user_ids: Iterable[int], kind: str, delay: float = 0) -> int:
+        """Планирует одно и то же сообщение многим пользователям одной транзакцией"""
+        if kind not in self.handlers:
+            raise ValueError(f"Нет обработчика для отложенных сообщений {kind!r}")
+        due_at = time.time() + delay
+        added = await db.schedule_messages([(user_id, kind, due_at) for user_id in user_ids])
+        if added and (self._next_due is None or due_at < self._next_due):
+            self._wakeup.set()
+        return added
+
+    async def _sleep_until_due(self):
+        # Сначала сбрасываем событие и срок: schedule(), попавший в чтение ниже,
+        # увидит _next_due = None и разбудит цикл, а не потеряется
+        self._wakeup.clear()
+        self._next_due = None
+        self._next_due = await db.get_next_due_time()
+        if self._stopping:
+            return
+        timeout = None if self._next_due is None else max(0.0, self._next_due - time.time())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _process(self, message_id: int, user_id: int, kind: str) -> bool:
+        """Отправляет одно сообщение; False — оставить в очереди и повторить позже"""
+        handler = self.handlers.get(kind)
+        if handler is None:
+            logging.warning(f"Нет обработчика для отложенного сообщения {kind!r} (id {message_id})")
+            return True
+        try:
+            await handler(user_id)
+        except TelegramRetryAfter as e:
+            logging.warning(f"Отложенные сообщения: flood control, пауза {e.retry_after} с")
+            return False
+        except Exception as e:
+            logging.warning(f"Отложенное сообщение {kind} для {user_id} не отправлено: {e}")
+        return True
+
+    async def _send_due(self):
+        while True:
+            due = await db.get_due_messages(time.time(), self.batch_size)
+            if not due:
+                return
+            done = []
+            for message_id, user_id, kind in due:
+                if self._stopping:
+                    break
+                if await self._process(message_id, user_id, kind):
+                    done.append(message_id)
+            await db.delete_scheduled(done)
+            if len(done) < len(due):
+                return  # упёрлись в flood control или останавливаемся — ждём следующего цикла
+
+    async def run(self):
+        with outbound.lane(outbound.NOTIFY):
+            await self._loop()
+
+    def stop(self):
+        """Досылает текущее сообщение и завершает run(); остальные ждут в БД следующего запуска"""
+        self._stopping = True
+        self._wakeup.set()
+
+    async def _loop(self):
+        self._stopping = False
+        while not self._stopping:
+            try:
+                await self._sleep_until_due()
+                await self._send_due()
+            except Exception as e:
+                logging.exception(f"Ошибка планировщика отложенных сообщений: {e}")
+                await asyncio.sleep(5)
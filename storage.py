@@ -0,0 +1,160 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import database as db
+
+# === ХРАНИЛИЩЕ FSM В БАЗЕ БОТА ===
+# Состояния пишутся в таблицу fsm_states сразу (write-through), поэтому их видят
+# все процессы бота и они переживают перезапуск. Чтения обслуживаются из кэша
+# процесса не дольше cache_ttl секунд; при нескольких репликах за webhook кэш
+# стоит держать коротким или выключить (cache_ttl=0). Состояния, которые не
+# менялись дольше state_ttl, считаются брошенными и удаляются.
+# У большинства пользователей состояния нет вовсе. Чтобы они не стоили запроса
+# к БД на каждый апдейт, хранилище держит список ключей, у которых есть строка,
+# и перечитывает его раз в cache_ttl; в кэш попадают только существующие строки.
+
+FSM_CACHE_TTL = 5.0          # сек
+FSM_STATE_TTL = 24 * 60 * 60  # сек
+FSM_CACHE_SIZE = 10_000      # записей в кэше; дольше всех не читанные вытесняются
+
+CacheEntry = Tuple[Optional[str], Dict[str, Any], float]  # (state, data, когда закэшировано)
+
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        cache_ttl: float = FSM_CACHE_TTL,
+        state_ttl: float = FSM_STATE_TTL,
+        cache_size: int = FSM_CACHE_SIZE,
+    ):
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._keys: Set[str] = set()  # ключи, у которых есть строка в fsm_states
+        self._keys_loaded_at: Optional[float] = None
+        self._keys_refresh: Optional[asyncio.Task] = None
+        self._keys_changed: Dict[str, bool] = {}  # ключ -> есть ли строка; изменения за время перечитывания
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) if part is not None else '' for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    # === СПИСОК КЛЮЧЕЙ ===
+
+    async def _may_exist(self, key: str) -> bool:
+        """False — строки у key точно нет и в БД идти не нужно"""
+        if self.cache_ttl <= 0:
+            return True
+        if self._keys_loaded_at is None or time.monotonic() - self._keys_loaded_at >= self.cache_ttl:
+            # Одно перечитывание на всех, кто пришёл за ключами одновременно
+            if self._keys_refresh is None:
+                self._keys_changed = {}
+                self._keys_refresh = asyncio.create_task(self._reload_keys())
+            await asyncio.shield(self._keys_refresh)
+        return key in self._keys
+
+    async def _reload_keys(self):
+        try:
+            keys = set(await db.get_fsm_keys())
+            # Записи, сделанные пока шёл запрос, могли в него не попасть
+            for key, exists in self._keys_changed.items():
+                if exists:
+                    keys.add(key)
+                else:
+                    keys.discard(key)
+            self._keys = keys
+            self._keys_loaded_at = time.monotonic()
+        finally:
+            self._keys_refresh = None
+
+    def _mark(self, key: str, exists: bool):
+        if exists:
+            self._keys.add(key)
+        else:
+            self._keys.discard(key)
+        if self._keys_refresh is not None:
+            self._keys_changed[key] = exists
+
+    # === ЧТЕНИЕ И ЗАПИСЬ ===
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[2] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                return cached[0], cached[1]
+            del self._cache[key]
+
+        if not await self._may_exist(key):
+            return None, {}
+        record = await db.get_fsm_record(key)
+        if record is None:
+            self._mark(key, False)
+            return None, {}
+        if time.time() - record[2] > self.state_ttl:
+            await db.delete_fsm_states(key)
+            self._mark(key, False)
+            return None, {}
+        state, data = record[0], json.loads(record[1])
+        self._remember(key, state, data)
+        return state, data
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._cache.pop(key, None)
+        if self.cache_ttl <= 0 or (state is None and not data):
+            return  # пустое состояние не хранится ни в БД, ни в кэше
+        self._cache[key] = (state, data, time.monotonic())
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _save(self, key: str, existed: bool, state: Optional[str], data: Dict[str, Any], write):
+        """Пишет состояние через write(); пустое удаляет, если строка была"""
+        if state is None and not data:
+            if existed:
+                await db.delete_fsm_states(key)
+            self._mark(key, False)
+        else:
+            await write()
+            self._mark(key, True)
+        self._remember(key, state, data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self._key(key)
+        state = state.state if isinstance(state, State) else state
+        old_state, data = await self._load(key)
+        existed = old_state is not None or bool(data)
+        await self._save(key, existed, state, data, lambda: db.set_fsm_state(key, state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        key = self._key(key)
+        data = dict(data)
+        state, old_data = await self._load(key)
+        existed = state is not None or bool(old_data)
+        await self._save(key, existed, state, data, lambda: db.set_fsm_data(key, json.dumps(data, ensure_ascii=False)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return dict(data)
+
+    async def purge_expired(self) -> int:
+        """Удаляет из БД брошенные состояния, возвращает их число"""
+        self._cache.clear()
+        self._keys_loaded_at = None  # список ключей перечитается при следующем обращении
+        return await db.delete_fsm_states(updated_before=time.time() - self.state_ttl)
+
+    async def close(self) -> None:
+        self._cache.clear()
+        self._keys.clear()
+        self._keys_loaded_at = None
@@ -0,0 +1,24 @@
+import os
+import tempfile
+import unittest
+
+import database as db
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    """Каждый тест работает со своей users.db во временном каталоге"""
+
+    init_db = True  # False — тест сам готовит файл и вызывает db.init_db()
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_name = db.DB_NAME
+        db.DB_NAME = os.path.join(self.tmp.name, 'users.db')
+        if self.init_db:
+            await db.init_db()
+
+    async def asyncTearDown(self):
+        if db._writer is not None:
+            await db.close_db()
+        db.DB_NAME = self.db_name
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+import database as db
+from dbcase import DatabaseTestCase
+
+
+class CloseDatabaseTest(DatabaseTestCase):
+    async def test_close_does_not_block_loop_on_long_query(self):
+        # Долгий запрос в потоке-читателе, как резервная копия
+        long_query = asyncio.ensure_future(db._run(db._readers, time.sleep, 0.5))
+        await asyncio.sleep(0.01)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        started = time.monotonic()
+        await db.close_db(timeout=0.1)
+        elapsed = time.monotonic() - started
+        ticking.cancel()
+
+        self.assertLess(elapsed, 0.4)
+        self.assertGreater(ticks, 3)
+        await long_query  # поток доделывает запрос сам
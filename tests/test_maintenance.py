@@ -0,0 +1,33 @@
+import os
+import sqlite3
+
+import database as db
+from dbcase import DatabaseTestCase
+from maintenance import Maintenance
+
+
+class VacuumTest(DatabaseTestCase):
+    init_db = False
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.maintenance = Maintenance(backup_dir=os.path.join(self.tmp.name, 'backups'))
+
+    async def test_new_database_is_incremental(self):
+        await db.init_db()
+        self.assertEqual(await db.get_auto_vacuum(), 2)
+        self.assertIn('освобождено страниц', await self.maintenance.run_job('vacuum'))
+
+    async def test_existing_database_is_converted_only_explicitly(self):
+        conn = sqlite3.connect(db.DB_NAME)
+        conn.execute('CREATE TABLE legacy (id INTEGER PRIMARY KEY)')
+        conn.close()
+
+        await db.init_db()
+        self.assertEqual(await db.get_auto_vacuum(), 0)
+        self.assertIn('пропущено', await self.maintenance.run_job('vacuum'))
+
+        self.assertTrue(await db.enable_incremental_vacuum())
+        self.assertFalse(await db.enable_incremental_vacuum())
+        self.assertEqual(await db.get_auto_vacuum(), 2)
+        self.assertIn('освобождено страниц', await self.maintenance.run_job('vacuum'))
@@ -0,0 +1,65 @@
+import asyncio
+import time
+import unittest
+
+import outbound
+from outbound import Outbound
+
+
+class OutboundTest(unittest.IsolatedAsyncioTestCase):
+    async def grant_order(self, dispatcher: Outbound, requests):
+        """Запускает acquire для (метка, chat_id, полоса) и возвращает метки в порядке выдачи слотов"""
+        order = []
+
+        async def acquire(label, chat_id, lane_name):
+            await dispatcher.acquire(chat_id, lane_name)
+            order.append(label)
+
+        await asyncio.gather(*(acquire(*request) for request in requests))
+        return order
+
+    async def test_interactive_goes_before_bulk(self):
+        dispatcher = Outbound(rate=50, burst=1)
+        order = await self.grant_order(dispatcher, [
+            ('bulk1', 1, outbound.BULK),
+            ('bulk2', 2, outbound.BULK),
+            ('notify', 3, outbound.NOTIFY),
+            ('reply', 4, outbound.INTERACTIVE),
+        ])
+        self.assertEqual(order, ['reply', 'notify', 'bulk1', 'bulk2'])
+
+    async def test_busy_chat_does_not_block_others(self):
+        dispatcher = Outbound(rate=1000, burst=10, chat_rate=10, chat_burst=1)
+        started = time.monotonic()
+        order = await self.grant_order(dispatcher, [
+            ('first', 1, outbound.INTERACTIVE),
+            ('second', 1, outbound.INTERACTIVE),
+            ('other', 2, outbound.BULK),
+        ])
+        # Второе сообщение в чат 1 ждёт его темпа, рассылка в свободный чат идёт раньше
+        self.assertEqual(order, ['first', 'other', 'second'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    async def test_pause_delays_all_sends(self):
+        dispatcher = Outbound(rate=1000, burst=10)
+        dispatcher.pause(0.1)
+        started = time.monotonic()
+        await dispatcher.acquire(1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    async def test_lane_is_taken_from_context(self):
+        dispatcher = Outbound(rate=50, burst=1)
+        order = []
+
+        async def send(label, chat_id):
+            await dispatcher.acquire(chat_id)
+            order.append(label)
+
+        with outbound.lane(outbound.BULK):
+            bulk = asyncio.create_task(send('bulk', 1))
+        reply = asyncio.create_task(send('reply', 2))
+        await asyncio.gather(bulk, reply)
+        self.assertEqual(order, ['reply', 'bulk'])
+        with self.assertRaises(ValueError):
+            with outbound.lane('unknown'):
+                pass
@@ -0,0 +1,57 @@
+import unittest
+
+from ratelimit import RateLimiter, SlidingWindowLimiter, TokenBucketLimiter, create_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SlidingWindowLimiterTest(unittest.TestCase):
+    def test_burst_within_window(self):
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter(window=5, burst=2, clock=clock)
+        self.assertEqual([limiter.hit(1) for _ in range(3)], [False, False, True])
+        self.assertFalse(limiter.hit(2))  # у другого пользователя своё окно
+        clock.now += 5
+        self.assertFalse(limiter.hit(1))
+
+    def test_spam_is_not_recorded_as_activity(self):
+        limiter = SlidingWindowLimiter(window=5, clock=FakeClock())
+        limiter.hit(1)
+        limiter.hit(1)
+        self.assertEqual([user_id for user_id, _ in limiter.drain_last_seen()], [1])
+        limiter.hit(1)
+        self.assertEqual(limiter.drain_last_seen(), [])
+
+    def test_memory_is_bounded(self):
+        clock = FakeClock()
+        limiter = SlidingWindowLimiter(window=5, max_entries=3, clock=clock)
+        for user_id in range(10):
+            limiter.hit(user_id)
+        self.assertEqual(len(limiter), 3)
+        # Записи с истёкшим окном вытесняются и без переполнения
+        clock.now += 5
+        limiter.hit(100)
+        self.assertEqual(len(limiter), 1)
+
+
+class TokenBucketLimiterTest(unittest.TestCase):
+    def test_refills_at_rate(self):
+        clock = FakeClock()
+        limiter = TokenBucketLimiter(window=4, burst=2, clock=clock)
+        self.assertEqual([limiter.hit(1) for _ in range(3)], [False, False, True])
+        clock.now += 2  # пополнился один токен
+        self.assertEqual([limiter.hit(1) for _ in range(2)], [False, True])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            create_limiter('leaky', window=1)
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            RateLimiter()
@@ -0,0 +1,112 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import database as db
+import scheduler as scheduler_module
+from dbcase import DatabaseTestCase
+from scheduler import Scheduler
+
+
+class FakeQueue:
+    """Очередь отложенных сообщений в памяти вместо таблицы scheduled_messages"""
+
+    def __init__(self):
+        self.rows = {}  # id -> (user_id, kind, due_at)
+        self.next_id = 1
+        self.read_started = asyncio.Event()
+        self.read_gate = asyncio.Event()
+        self.read_gate.set()
+
+    async def schedule_message(self, user_id, kind, due_at):
+        self.rows[self.next_id] = (user_id, kind, due_at)
+        self.next_id += 1
+        return True
+
+    async def get_next_due_time(self):
+        # Значение читается до ожидания: так выглядит чтение, в которое попала вставка
+        due = min((row[2] for row in self.rows.values()), default=None)
+        self.read_started.set()
+        await self.read_gate.wait()
+        return due
+
+    async def get_due_messages(self, now, limit):
+        due = sorted((row[2], message_id) for message_id, row in self.rows.items() if row[2] <= now)
+        return [(message_id, *self.rows[message_id][:2]) for _, message_id in due[:limit]]
+
+    async def delete_scheduled(self, ids):
+        for message_id in ids:
+            self.rows.pop(message_id, None)
+
+    def api(self):
+        return SimpleNamespace(
+            schedule_message=self.schedule_message,
+            get_next_due_time=self.get_next_due_time,
+            get_due_messages=self.get_due_messages,
+            delete_scheduled=self.delete_scheduled,
+        )
+
+
+class SchedulerWakeupTest(unittest.IsolatedAsyncioTestCase):
+    async def test_schedule_during_due_time_read_wakes_loop(self):
+        queue = FakeQueue()
+        sent = []
+        scheduler = Scheduler()
+        scheduler.handler('followup')(lambda user_id: asyncio.sleep(0, sent.append(user_id)))
+
+        with mock.patch.object(scheduler_module, 'db', queue.api()):
+            queue.read_gate.clear()
+            task = asyncio.create_task(scheduler.run())
+            try:
+                await queue.read_started.wait()
+                # Вставка успевает до конца чтения, а чтение возвращает старое None
+                await scheduler.schedule(42, 'followup', 0.05)
+                queue.read_gate.set()
+                for _ in range(100):
+                    if sent:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                scheduler.stop()
+                await asyncio.wait_for(task, 1)
+
+        self.assertEqual(sent, [42])
+        self.assertEqual(queue.rows, {})
+
+
+class SchedulerDatabaseTest(DatabaseTestCase):
+    async def test_sends_due_messages_and_keeps_future_ones(self):
+        sent = []
+        scheduler = Scheduler()
+
+        @scheduler.handler('followup')
+        async def followup(user_id: int):
+            sent.append((user_id, time.monotonic()))
+
+        task = asyncio.create_task(scheduler.run())
+        try:
+            started = time.monotonic()
+            await scheduler.schedule(1, 'followup', 0.1)
+            await scheduler.schedule_many([2, 3], 'followup', 0)
+            await scheduler.schedule(4, 'followup', 60)
+            for _ in range(100):
+                if len(sent) == 3:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            scheduler.stop()
+            await asyncio.wait_for(task, 1)
+
+        self.assertEqual(sorted(user_id for user_id, _ in sent), [1, 2, 3])
+        self.assertGreaterEqual(dict(sent)[1] - started, 0.09)
+        self.assertEqual(await db.count_scheduled('followup'), 1)
+
+    async def test_repeated_schedule_is_ignored(self):
+        scheduler = Scheduler()
+        scheduler.handler('followup')(lambda user_id: asyncio.sleep(0))
+        self.assertTrue(await scheduler.schedule(1, 'followup', 60))
+        self.assertFalse(await scheduler.schedule(1, 'followup', 60))
+        with self.assertRaises(ValueError):
+            await scheduler.schedule(1, 'unknown', 60)
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from aiogram.fsm.storage.base import StorageKey
+
+import database as db
+from dbcase import DatabaseTestCase
+from storage import SQLiteStorage
+
+
+def make_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+class SQLiteStorageTest(DatabaseTestCase):
+    async def test_user_without_state_costs_no_queries(self):
+        storage = SQLiteStorage()
+        await storage.get_state(make_key(1))  # первое обращение читает список ключей
+        with mock.patch.object(db, 'get_fsm_record', wraps=db.get_fsm_record) as get_record, \
+                mock.patch.object(db, 'delete_fsm_states', wraps=db.delete_fsm_states) as delete:
+            for user_id in range(2, 50):
+                self.assertIsNone(await storage.get_state(make_key(user_id)))
+                self.assertEqual(await storage.get_data(make_key(user_id)), {})
+                # FSMContext.clear() у пользователя без состояния
+                await storage.set_state(make_key(user_id), None)
+                await storage.set_data(make_key(user_id), {})
+        get_record.assert_not_called()
+        delete.assert_not_called()
+        self.assertEqual(len(storage._cache), 0)
+
+    async def test_state_survives_restart_and_clear_removes_row(self):
+        storage = SQLiteStorage()
+        await storage.set_state(make_key(1), 'Form:question')
+        await storage.set_data(make_key(1), {'text': 'привет'})
+
+        restarted = SQLiteStorage()
+        self.assertEqual(await restarted.get_state(make_key(1)), 'Form:question')
+        self.assertEqual(await restarted.get_data(make_key(1)), {'text': 'привет'})
+
+        await restarted.set_state(make_key(1), None)
+        await restarted.set_data(make_key(1), {})
+        self.assertEqual(await db.get_fsm_keys(), [])
+        self.assertIsNone(await SQLiteStorage().get_state(make_key(1)))
+
+    async def test_cache_is_bounded(self):
+        storage = SQLiteStorage(cache_size=2)
+        for user_id in (1, 2, 3):
+            await storage.set_state(make_key(user_id), f'state{user_id}')
+        self.assertEqual(len(storage._cache), 2)
+        self.assertNotIn(storage._key(make_key(1)), storage._cache)
+        # Вытесненное из кэша читается из БД
+        self.assertEqual(await storage.get_state(make_key(1)), 'state1')
+        self.assertNotIn(storage._key(make_key(2)), storage._cache)
+
+    async def test_without_cache_reads_other_writers(self):
+        writer = SQLiteStorage()
+        reader = SQLiteStorage(cache_ttl=0)
+        self.assertIsNone(await reader.get_state(make_key(1)))
+        await writer.set_state(make_key(1), 'Form:question')
+        self.assertEqual(await reader.get_state(make_key(1)), 'Form:question')
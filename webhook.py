@@ -0,0 +1,98 @@
+import asyncio
+import hmac
+import logging
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+# === РЕЖИМ WEBHOOK ===
+# Telegram присылает апдейты POST-запросами на наш адрес. Запрос проверяется по
+# секретному токену (без него сервер не запускается) и сразу подтверждается, а обработка идёт в пуле из workers
+# задач — так медленный хендлер не задерживает ответ Telegram и остальные апдейты.
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+QUEUE_SIZE = 10_000  # апдейтов в очереди; при переполнении отвечаем 503 и Telegram повторит
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str,
+        secret: str,
+        workers: int = 16,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        if not secret:
+            raise ValueError("Режим webhook требует секретный токен (WEBHOOK_SECRET)")
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logging.warning(f"Webhook: некорректный апдейт: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logging.warning("Webhook: очередь апдейтов переполнена")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.exception(f"Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str, port: int, url: Optional[str]):
+        """Запускает HTTP-сервер, воркеры и регистрирует webhook в Telegram (если задан url)"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Webhook: слушаем {host}:{port}{self.path}, воркеров: {self.workers}")
+        if url:
+            await self.bot.set_webhook(
+                url=url.rstrip('/') + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+            logging.info("Webhook зарегистрирован в Telegram.")
+
+    async def stop(self, unregister: bool = True, drain_timeout: float = 10.0):
+        """Снимает webhook, перестаёт принимать апдейты и дожидается обработки принятых"""
+        if unregister:
+            try:
+                await self.bot.delete_webhook()
+            except Exception as e:
+                logging.warning(f"Не удалось снять webhook: {e}")
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook: не обработано апдейтов при остановке: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []